@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ContactsConfig(AppConfig):
     name = 'contacts'
     verbose_name = 'gestion de contacts'
+
+    def ready(self):
+        from . import signals  # noqa
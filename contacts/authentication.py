@@ -1,4 +1,6 @@
+from django.contrib import auth
 from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
 
 
 class RowLevelPermissionBackend(ModelBackend):
@@ -9,3 +11,49 @@ class RowLevelPermissionBackend(ModelBackend):
             if hasattr(obj, 'is_owned') and callable(obj.is_owned):
                 return obj.is_owned(user_obj, perm)
         return has_perm
+
+    def filter_perm(self, user_obj, perm, objs):
+        """
+        Returns the objects of a list on which the user has the permission.
+        The model permission is checked once, and ownership in a single query
+        at most, for models whose is_owned() needs related objects (see
+        get_owned_pks()).
+        The permissions of the user are cached on the user instance by
+        ModelBackend, hence for the whole request with `request.user`.
+        """
+        objs = list(objs)
+        if len(objs) == 0 or not super().has_perm(user_obj, perm):
+            return []
+        model = type(objs[0])
+        if hasattr(model, 'get_owned_pks'):
+            owned = model.get_owned_pks(user_obj, [obj.pk for obj in objs])
+            return [obj for obj in objs if obj.pk in owned]
+        return [obj for obj in objs if not hasattr(obj, 'is_owned')
+                or obj.is_owned(user_obj, perm)]
+
+
+def filter_perm(user, perm, objs):
+    """
+    Batch equivalent of `user.has_perm(perm, obj)` for each object of a
+    list: returns the objects on which the user has the permission.
+    Like User.has_perm(), active superusers have all the permissions, and an
+    object is allowed as soon as one of the backends allows it.
+    """
+    objs = list(objs)
+    if user.is_active and user.is_superuser:
+        return objs
+    allowed = set()
+    for backend in auth.get_backends():
+        remaining = [obj for obj in objs if id(obj) not in allowed]
+        if len(remaining) == 0:
+            break
+        try:
+            if hasattr(backend, 'filter_perm'):
+                allowed.update(id(obj) for obj in
+                               backend.filter_perm(user, perm, remaining))
+            elif hasattr(backend, 'has_perm'):
+                allowed.update(id(obj) for obj in remaining
+                               if backend.has_perm(user, perm, obj))
+        except PermissionDenied:
+            break
+    return [obj for obj in objs if id(obj) in allowed]
@@ -0,0 +1,191 @@
+import sys
+import time
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+
+from django.conf import settings
+from unidecode import unidecode
+
+
+# set AUTOCOMPLETE_INDEX to True in the settings to answer autocomplete
+# requests from the in-process indexes
+AUTOCOMPLETE_MEMORY_BUDGET = getattr(settings, 'AUTOCOMPLETE_MEMORY_BUDGET',
+                                     64 * 1024 * 1024)
+AUTOCOMPLETE_REFRESH_INTERVAL = getattr(settings,
+                                        'AUTOCOMPLETE_REFRESH_INTERVAL', 5)
+AUTOCOMPLETE_RELOAD_INTERVAL = getattr(settings,
+                                       'AUTOCOMPLETE_RELOAD_INTERVAL', 600)
+AUTOCOMPLETE_MAX_DELTA = 1000
+ENTRY_OVERHEAD = 150  # bytes per entry, for lists, tuples and dicts
+
+
+def is_enabled():
+    return getattr(settings, 'AUTOCOMPLETE_INDEX', False)
+
+
+def normalize(value):
+    return ' '.join(unidecode(value).lower().split())
+
+
+class IndexedChoice():
+    """
+    Autocomplete choice answered from an index, without a model instance.
+    """
+
+    def __init__(self, pk, label):
+        self.pk = pk
+        self.label = label
+
+    def __str__(self):
+        return self.label
+
+
+class NameIndex():
+    """
+    Sorted array of the normalized names of the objects of a group, searched
+    by prefix with a binary search.
+    It is loaded on first use, then refreshed from the objects updated since
+    the last refresh (update_date), and fully reloaded from time to time to
+    forget the deleted ones. Its lock only serializes the requests of its
+    group.
+    """
+
+    def __init__(self, model, group_id, fields, make_keys):
+        self.lock = threading.Lock()
+        self.model = model
+        self.group_id = group_id
+        self.fields = fields
+        self.make_keys = make_keys
+        self.entries = []  # sorted (normalized key, pk)
+        self.keys = {}  # pk -> normalized keys
+        self.labels = {}  # pk -> label
+        self.size = 0
+        self.last_update = None
+        self.refresh_time = 0
+        self.load_time = 0
+
+    def _rows(self, qs):
+        return qs.filter(group_id=self.group_id).values_list(
+            'pk', 'update_date', *self.fields).iterator()
+
+    def _add(self, row, bulk=False):
+        pk, update_date = row[:2]
+        label, keys = self.make_keys(*row[2:])
+        keys = [normalize(key) for key in keys]
+        if pk in self.keys:
+            self.remove(pk)
+        for key in keys:
+            if bulk:
+                self.entries.append((key, pk))
+            else:
+                insort(self.entries, (key, pk))
+            self.size += sys.getsizeof(key) + ENTRY_OVERHEAD
+        self.keys[pk] = keys
+        self.labels[pk] = label
+        self.size += sys.getsizeof(label) + ENTRY_OVERHEAD
+        if self.last_update is None or update_date > self.last_update:
+            self.last_update = update_date
+
+    def remove(self, pk):
+        for key in self.keys.pop(pk, ()):
+            i = bisect_left(self.entries, (key, pk))
+            if i < len(self.entries) and self.entries[i] == (key, pk):
+                del self.entries[i]
+            self.size -= sys.getsizeof(key) + ENTRY_OVERHEAD
+        label = self.labels.pop(pk, None)
+        if label is not None:
+            self.size -= sys.getsizeof(label) + ENTRY_OVERHEAD
+
+    def load(self):
+        self.entries = []
+        self.keys = {}
+        self.labels = {}
+        self.size = 0
+        self.last_update = None
+        for row in self._rows(self.model.objects.all()):
+            self._add(row, bulk=True)
+        self.entries.sort()
+        self.load_time = self.refresh_time = time.time()
+
+    def refresh(self):
+        now = time.time()
+        if now - self.load_time > AUTOCOMPLETE_RELOAD_INTERVAL:
+            self.load()
+        elif now - self.refresh_time > AUTOCOMPLETE_REFRESH_INTERVAL:
+            qs = self.model.objects.all()
+            if self.last_update is not None:
+                qs = qs.filter(update_date__gte=self.last_update)
+            rows = list(self._rows(qs))
+            if len(rows) > AUTOCOMPLETE_MAX_DELTA:
+                # sorting again is cheaper than many insertions
+                self.load()
+                return
+            for row in rows:
+                self._add(row)
+            self.refresh_time = now
+
+    def search(self, query, limit, exclude=()):
+        prefix = normalize(query)
+        choices = []
+        found = set(exclude)
+        i = bisect_left(self.entries, (prefix, ))
+        while i < len(self.entries) and len(choices) < limit:
+            key, pk = self.entries[i]
+            if not key.startswith(prefix):
+                break
+            if pk not in found:
+                found.add(pk)
+                choices.append(IndexedChoice(pk, self.labels[pk]))
+            i += 1
+        return choices
+
+
+# (model, group id) -> index, most recently used last
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _evict():
+    total = sum(index.size for index in _indexes.values())
+    while total > AUTOCOMPLETE_MEMORY_BUDGET and len(_indexes) > 1:
+        key, index = _indexes.popitem(last=False)
+        total -= index.size
+
+
+def complete(model, group_id, query, limit, fields, make_keys, exclude=()):
+    """
+    Returns the objects of a group whose names start with the query, as
+    IndexedChoice instances, from the index of the group (which is loaded
+    or refreshed if needed). Indexes are evicted, least recently used first,
+    when their total size gets over AUTOCOMPLETE_MEMORY_BUDGET bytes.
+    Indexes are loaded and refreshed out of the global lock, so that a
+    group never waits for the database queries of another one.
+    """
+    key = (model, group_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+    if index is None:
+        index = NameIndex(model, group_id, fields, make_keys)
+        with index.lock:
+            index.load()
+        with _lock:
+            # another request may have loaded the group meanwhile
+            index = _indexes.setdefault(key, index)
+            _evict()
+    with index.lock:
+        index.refresh()
+        return index.search(query, limit, exclude)
+
+
+def forget(model, group_id, pk):
+    """
+    Removes a deleted object from the index of its group, if loaded.
+    """
+    with _lock:
+        index = _indexes.get((model, group_id))
+    if index is not None:
+        with index.lock:
+            index.remove(pk)
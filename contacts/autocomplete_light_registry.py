@@ -1,11 +1,38 @@
 import autocomplete_light
 
 from .models import Company, Contact
+from . import autocomplete
 
 
-class ContactAutocomplete(autocomplete_light.AutocompleteModelBase):
+class IndexedAutocompleteMixin():
+    """
+    Answers from the in-process name index of the group when the
+    AUTOCOMPLETE_INDEX setting is set, instead of querying the database.
+    Subclasses define the indexed fields, and index_keys() which returns the
+    label and the searchable names of an object from their values.
+    The index only matches the start of these names, whereas search_fields
+    may match any part of them (see ContactAutocomplete).
+    """
+    index_fields = ()
+
+    def choices_for_request(self):
+        if not autocomplete.is_enabled():
+            return super().choices_for_request()
+        exclude = set()
+        for value in self.request.GET.getlist('exclude'):
+            if value.isdigit():
+                exclude.add(int(value))
+        return autocomplete.complete(
+            self.model, self.request.user.default_group.group_id,
+            self.request.GET.get('q', ''), self.limit_choices,
+            self.index_fields, self.index_keys, exclude)
+
+
+class ContactAutocomplete(IndexedAutocompleteMixin,
+                          autocomplete_light.AutocompleteModelBase):
     model = Contact
     search_fields = ['^firstname', 'lastname']
+    index_fields = ('firstname', 'lastname')
     attrs = {
         # This will set the input placeholder attribute:
         'placeholder': 'Nom du contact',
@@ -23,6 +50,15 @@ class ContactAutocomplete(autocomplete_light.AutocompleteModelBase):
         'class': 'modern-style',
     }
 
+    # unlike the database search, which finds the query anywhere in the last
+    # names, the index finds the names starting with the query, as « first
+    # last » or « last first »: « pont » doesn't find « Jean Dupont », but
+    # « jean d » does
+    @staticmethod
+    def index_keys(firstname, lastname):
+        label = '{} {}'.format(firstname, lastname)
+        return label, [label, '{} {}'.format(lastname, firstname)]
+
     def choices_for_request(self):
         self.choices = self.model.get_queryset(self.request.user,
                                                self.choices)
@@ -30,9 +66,11 @@ class ContactAutocomplete(autocomplete_light.AutocompleteModelBase):
         return super().choices_for_request()
 
 
-class CompanyAutocomplete(autocomplete_light.AutocompleteModelBase):
+class CompanyAutocomplete(IndexedAutocompleteMixin,
+                          autocomplete_light.AutocompleteModelBase):
     model = Company
     search_fields = ['^name']
+    index_fields = ('name', )
     attrs = {
         'placeholder': 'Nom de la société',
         'data-autocomplete-minimum-characters': 1,
@@ -42,6 +80,10 @@ class CompanyAutocomplete(autocomplete_light.AutocompleteModelBase):
         'class': 'modern-style',
     }
 
+    @staticmethod
+    def index_keys(name):
+        return name, [name]
+
     def choices_for_request(self):
         self.choices = self.model.get_queryset(self.request.user,
                                                self.choices)
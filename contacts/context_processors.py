@@ -4,15 +4,11 @@ from .models import SavedSearch
 def saved_searches(request):
     context = {}
     if request.user.is_authenticated():
-        searches = SavedSearch.get_queryset(request.user)\
-            .filter(display_in_menu=True)
-        context['companies_displayed_searches'] = searches.filter(
-            type='Company')
-        context['contacts_displayed_searches'] = searches.filter(
-            type='Contact')
-        context['meetings_displayed_searches'] = searches.filter(
-            type='Meeting')
-        context['alerts_displayed_searches'] = searches.filter(type='Alert')
+        menu = SavedSearch.get_menu(request.user.default_group.group_id)
+        context['companies_displayed_searches'] = menu['Company']
+        context['contacts_displayed_searches'] = menu['Contact']
+        context['meetings_displayed_searches'] = menu['Meeting']
+        context['alerts_displayed_searches'] = menu['Alert']
     return context
 
 
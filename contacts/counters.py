@@ -0,0 +1,23 @@
+from django.db import connections
+
+
+# recomputes the counters maintained by the database triggers (see the
+# counter_fields Meta option), without loading any model
+REFRESH_COUNTERS = '''
+UPDATE contacts_company SET contacts_count = (
+    SELECT count(*) FROM contacts_contact
+    WHERE company_id = contacts_company.id);
+UPDATE contacts_contact SET meetings_count = (
+    SELECT count(*) FROM contacts_meeting
+    WHERE contact_id = contacts_contact.id), open_alerts_count = (
+    SELECT count(*) FROM contacts_alert
+    WHERE contact_id = contacts_contact.id AND NOT done);
+'''
+
+
+def refresh_counters():
+    """
+    Recomputes the counters maintained by the database triggers.
+    """
+    with connections['default'].cursor() as cursor:
+        cursor.execute(REFRESH_COUNTERS)
@@ -87,3 +87,32 @@ def classmethod_cache(seconds=0):
         return x
 
     return inner_cache
+
+
+def versioned_key(name):
+    """
+    Returns a cache key made of `name` and its current version, so that the
+    values cached under it are forgotten when bump_version(name) is called.
+    Versions are kept in the cache without expiration.
+    """
+
+    import time
+    from django.core.cache import cache
+
+    version_key = 'version-{}'.format(name)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time(), None)
+        version = cache.get(version_key)
+    return '{}-{}'.format(name, version)
+
+
+def bump_version(name):
+    """
+    Changes the version of `name`, invalidating its versioned keys.
+    """
+
+    import time
+    from django.core.cache import cache
+
+    cache.set('version-{}'.format(name), time.time(), None)
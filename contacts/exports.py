@@ -0,0 +1,152 @@
+import csv
+import json
+import zlib
+import struct
+from collections import OrderedDict
+
+from .models import chunks
+
+
+COLUMNAR_MAGIC = b'PYRC1\n'
+COLUMNAR_GROUP_SIZE = 10000
+GZIP_FLUSH_SIZE = 64 * 1024
+
+
+class Echo:
+    """
+    File-like object handing back what is written to it, for CSV writers to
+    feed a streaming response.
+    """
+
+    def write(self, value):
+        return value
+
+
+def write_csv(header, rows):
+    """
+    Iterates through the lines of a CSV file.
+    """
+    writer = csv.writer(Echo(), escapechar='\\', doublequote=False)
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_csv_gzip(header, rows):
+    """
+    Iterates through the chunks of a gzip-compressed CSV file. Lines are
+    compressed as they come, and handed back by blocks of about
+    GZIP_FLUSH_SIZE compressed bytes.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buffer = []
+    size = 0
+    for line in write_csv(header, rows):
+        data = compressor.compress(line.encode())
+        if data:
+            buffer.append(data)
+            size += len(data)
+        if size >= GZIP_FLUSH_SIZE:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(compressor.flush())
+    yield b''.join(buffer)
+
+
+def write_ndjson(header, rows):
+    """
+    Iterates through the lines of a newline-delimited JSON file, one object
+    per row.
+    """
+    for row in rows:
+        yield json.dumps(OrderedDict(zip(header, row)),
+                         ensure_ascii=False) + '\n'
+
+
+def _pack_column(values):
+    """
+    Packs the values of a column: integer columns as little-endian 64 bits
+    integers, others as an offsets table followed by the UTF-8 data.
+    """
+    if all(type(value) is int for value in values):
+        return b'i', struct.pack('<{}q'.format(len(values)), *values)
+    data = [str(value).encode() for value in values]
+    offsets = [0]
+    for value in data:
+        offsets.append(offsets[-1] + len(value))
+    return b's', struct.pack('<{}I'.format(len(offsets)), *offsets) + \
+        b''.join(data)
+
+
+def write_columnar(header, rows, group_size=COLUMNAR_GROUP_SIZE):
+    """
+    Iterates through the chunks of a columnar binary file, which can be read
+    back with read_columnar() without any text parsing:
+    - the COLUMNAR_MAGIC bytes, then the JSON list of the column names,
+      prefixed by its length;
+    - row groups of at most `group_size` rows: the number of rows, then
+      each column as a type (b'i' or b's'), a length and the packed values;
+    - an empty row group.
+    All lengths and counts are little-endian 32 bits integers.
+    """
+    names = json.dumps(header).encode()
+    yield COLUMNAR_MAGIC + struct.pack('<I', len(names)) + names
+    for group in chunks(rows, group_size):
+        data = [struct.pack('<I', len(group))]
+        for values in zip(*group):
+            kind, packed = _pack_column(values)
+            data += [kind, struct.pack('<I', len(packed)), packed]
+        yield b''.join(data)
+    yield struct.pack('<I', 0)
+
+
+def _read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated columnar file.')
+    return data
+
+
+def _unpack_column(kind, data, count):
+    if kind == b'i':
+        return struct.unpack('<{}q'.format(count), data)
+    start = 4 * (count + 1)
+    offsets = struct.unpack('<{}I'.format(count + 1), data[:start])
+    return [data[start + offsets[i]:start + offsets[i + 1]].decode()
+            for i in range(count)]
+
+
+def read_columnar(stream):
+    """
+    Reads a file written by write_columnar(). Returns the list of column
+    names and an iterator over the rows, as tuples.
+    """
+    if stream.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('Not a columnar file.')
+    size, = struct.unpack('<I', _read_exactly(stream, 4))
+    header = json.loads(_read_exactly(stream, size).decode())
+
+    def rows():
+        while True:
+            count, = struct.unpack('<I', _read_exactly(stream, 4))
+            if count == 0:
+                return
+            columns = []
+            for name in header:
+                kind = _read_exactly(stream, 1)
+                size, = struct.unpack('<I', _read_exactly(stream, 4))
+                columns.append(_unpack_column(
+                    kind, _read_exactly(stream, size), count))
+            yield from zip(*columns)
+
+    return header, rows()
+
+
+# format: (writer, content type, file extension)
+FORMATS = {
+    'csv': (write_csv, 'text/csv', 'csv'),
+    'csv.gz': (write_csv_gzip, 'application/gzip', 'csv.gz'),
+    'ndjson': (write_ndjson, 'application/x-ndjson', 'ndjson'),
+    'columnar': (write_columnar, 'application/octet-stream', 'pyrc'),
+}
@@ -1,5 +1,6 @@
 import operator
 from functools import reduce
+from collections import OrderedDict
 
 from django import forms
 from django.db.models import Q
@@ -10,6 +11,10 @@ from .models import (
     ContactType, Properties, MeetingType, SavedSearch, PRIORITIES
 )
 
+FULLTEXT_CONFIGURATION = 'public.pyru_french'
+PROPERTY_HELP_TEXT = '« =valeur » pour une valeur exacte, « début* » pour ' \
+    'les valeurs commençant par « début »'
+
 
 class SearchForm(forms.Form):
     bound_css_class = ''  # for django-bootstrap3 enhancement
@@ -25,13 +30,9 @@ class SearchForm(forms.Form):
         else:
             field_value = [field_value]
         for value in field_value:
-            subqueries = []
-            for target in mapping['target']:
-                filters = self._apply_filter(target, value)
-                subqueries.append(Q(**filters))
-
-                subquery = reduce(operator.or_, subqueries)
-            queries.append(subquery)
+            subqueries = [Q(**self._apply_filter(target, value))
+                          for target in mapping['target']]
+            queries.append(reduce(operator.or_, subqueries))
         if 'operator' in mapping \
                 and mapping['operator'] == 'and' \
                 and split_mode:
@@ -53,43 +54,92 @@ class SearchForm(forms.Form):
             filters[field_name] = field_value
         elif field_name.startswith('='):
             field_name = field_name[1:]
-            filters['{}__iequals'.format(field_name)] = field_value
+            filters['{}__iexact'.format(field_name)] = field_value
+        elif field_name.startswith('properties__'):
+            filters.update(self._apply_property_filter(field_name[12:],
+                                                       field_value))
         else:
             if field_name in self.fields \
                     and isinstance(self.fields[field_name], ModelChoiceField):
                 filters[field_name] = field_value
             else:
+                # served by the trigram indexes of the text columns
                 filters['{}__icontains'.format(field_name)] = field_value
         return filters
 
-    def search(self, qs):
+    def _apply_property_filter(self, name, field_value):
         """
-        Filters the given queryset with the contents of the form.
+        Filters on a property, so that the GIN index of the properties
+        column can be used: « =value » matches the exact value (hstore @>),
+        « value* » the values starting with it, and other values are searched
+        in the values of the items having this property.
+        """
+        if field_value.startswith('=') and len(field_value) > 1:
+            return {'properties__contains': {name: field_value[1:]}}
+        filters = {'properties__has_key': name}
+        if field_value.endswith('*') and len(field_value) > 1:
+            filters['properties__{}__startswith'.format(name)] = \
+                field_value[:-1]
+        else:
+            filters['properties__{}__icontains'.format(name)] = field_value
+        return filters
+
+    def _apply_fulltext(self, qs, field_value):
+        """
+        Filters the queryset on the search_vector column maintained by the
+        database, the best ranked results first.
+        """
+        query = "plainto_tsquery('{}', %s)".format(FULLTEXT_CONFIGURATION)
+        vector = '{}.search_vector'.format(qs.model._meta.db_table)
+        return qs.extra(
+            select={'search_rank': 'ts_rank({}, {})'.format(vector, query)},
+            select_params=[field_value],
+            where=['{} @@ {}'.format(vector, query)],
+            params=[field_value],
+            order_by=['-search_rank'],
+        )
+
+    def compile(self):
+        """
+        Compiles the contents of the form into a single Q object, so that
+        the search is one WHERE clause sharing its joins, and returns it with
+        the full-text search terms, if any.
         By default, the fields names are mapped to model fields, but you can
         override this with a 'mappings' attribute in the Meta class.
+        Conditions are sorted by field and deduplicated, so that a given
+        search always gives the same query, with one condition per field.
         """
         self.full_clean()
         mappings = self.Meta.mappings if hasattr(self, 'Meta') and\
             hasattr(self.Meta, 'mappings') else {}
-        if hasattr(self, 'cleaned_data'):
-            search = self.cleaned_data
-            filters = {}
-            for field_name, field_value in search.items():
-                if field_value is not None and field_value != '':
-                    if field_name in mappings:
-                        mapping = mappings[field_name]
-                        field_name = mapping['target']
-                        if isinstance(mapping['target'], list):
-                            qs = qs.filter(self._process_multiple_targets(
-                                field_name, field_value, mapping))
-                        else:
-                            filters.update(self._apply_filter(field_name,
-                                                              field_value))
-                            qs = qs.filter(**filters)
-                    else:
-                        filters.update(self._apply_filter(field_name,
-                                                          field_value))
-                        qs = qs.filter(**filters)
+        conditions = OrderedDict()
+        fulltext = None
+        search = getattr(self, 'cleaned_data', {})
+        for field_name, field_value in sorted(search.items()):
+            if field_value is None or field_value == '':
+                continue
+            mapping = mappings.get(field_name, {'target': field_name})
+            if mapping.get('fulltext', False):
+                fulltext = field_value
+            elif isinstance(mapping['target'], list):
+                query = self._process_multiple_targets(
+                    mapping['target'], field_value, mapping)
+                conditions.setdefault(str(query), query)
+            else:
+                query = Q(**self._apply_filter(mapping['target'],
+                                               field_value))
+                conditions.setdefault(str(query), query)
+        # each field is kept as a single child of the resulting Q object
+        return Q(*conditions.values()), fulltext
+
+    def search(self, qs):
+        """
+        Filters the given queryset with the contents of the form.
+        """
+        query, fulltext = self.compile()
+        qs = qs.filter(query)
+        if fulltext is not None:
+            qs = self._apply_fulltext(qs, fulltext)
         return qs
 
     def is_submitted(self):
@@ -100,6 +150,7 @@ class SearchForm(forms.Form):
 
 class ContactSearchForm(SearchForm):
     id = forms.CharField(label='ID', required=False, widget=forms.HiddenInput)
+    q = forms.CharField(label='commentaires', required=False)
     name = forms.CharField(label='nom', required=False)
     company = forms.CharField(label='société', required=False)
     creation_date_less = forms.DateTimeField(
@@ -133,6 +184,7 @@ class ContactSearchForm(SearchForm):
     class Meta:
         mappings = {'id': {'target': ['==pk'],
                            'split': True, 'operator': 'or', 'split_char': ','},
+                    'q': {'target': 'search_vector', 'fulltext': True},
                     'name': {'target': ['firstname', 'lastname'],
                              'split': True, 'operator': 'and'},
                     'company': {'target': ['company__name']},
@@ -148,12 +200,14 @@ class ContactSearchForm(SearchForm):
                 .filter(type='contact')
             for prop in self.properties:
                 self.base_fields['properties__{}'.format(prop.name)] = \
-                    forms.CharField(required=False, label=prop.name.title())
+                    forms.CharField(required=False, label=prop.name.title(),
+                                    help_text=PROPERTY_HELP_TEXT)
         super().__init__(*args, **kwargs)
 
 
 class CompanySearchForm(SearchForm):
     id = forms.CharField(label='ID', required=False, widget=forms.HiddenInput)
+    q = forms.CharField(label='commentaires', required=False)
     name = forms.CharField(label='nom', required=False)
     creation_date_less = forms.DateTimeField(
         label='ajouté avant le',
@@ -186,6 +240,7 @@ class CompanySearchForm(SearchForm):
     class Meta:
         mappings = {'id': {'target': ['==pk'],
                            'split': True, 'operator': 'or', 'split_char': ','},
+                    'q': {'target': 'search_vector', 'fulltext': True},
                     }
 
     def __init__(self, *args, **kwargs):
@@ -195,15 +250,17 @@ class CompanySearchForm(SearchForm):
                 ContactType.get_queryset(self.request.user)
 
             self.properties = Properties.get_queryset(self.request.user)\
-                .filter(type='contact')
+                .filter(type='company')
             for prop in self.properties:
                 self.base_fields['properties__{}'.format(prop.name)] = \
-                    forms.CharField(required=False, label=prop.name.title())
+                    forms.CharField(required=False, label=prop.name.title(),
+                                    help_text=PROPERTY_HELP_TEXT)
         super().__init__(*args, **kwargs)
 
 
 class MeetingSearchForm(SearchForm):
     id = forms.CharField(label='ID', required=False, widget=forms.HiddenInput)
+    q = forms.CharField(label='commentaires', required=False)
     contact = forms.CharField(label='nom du contact', required=False)
     company = forms.CharField(label='société', required=False)
     date_less = forms.DateTimeField(
@@ -255,6 +312,7 @@ class MeetingSearchForm(SearchForm):
     class Meta:
         mappings = {'id': {'target': ['==pk'],
                            'split': True, 'operator': 'or', 'split_char': ','},
+                    'q': {'target': 'search_vector', 'fulltext': True},
                     'contact': {'target': ['contact__firstname',
                                            'contact__lastname'],
                                 'split': True, 'operator': 'and'},
@@ -264,6 +322,7 @@ class MeetingSearchForm(SearchForm):
 
 class AlertSearchForm(SearchForm):
     id = forms.CharField(label='ID', required=False, widget=forms.HiddenInput)
+    q = forms.CharField(label='titre et commentaires', required=False)
     contact = forms.CharField(label='nom du contact', required=False)
     company = forms.CharField(label='société', required=False)
     date_less = forms.DateTimeField(
@@ -306,6 +365,7 @@ class AlertSearchForm(SearchForm):
     class Meta:
         mappings = {'id': {'target': ['==pk'],
                            'split': True, 'operator': 'or', 'split_char': ','},
+                    'q': {'target': 'search_vector', 'fulltext': True},
                     'contact': {'target': ['contact__firstname',
                                            'contact__lastname'],
                                 'split': True, 'operator': 'and'},
@@ -1,3 +1,10 @@
+import json
+import base64
+import operator
+from datetime import date
+from functools import reduce
+from hashlib import sha224
+
 from django.http import Http404
 from django.utils.http import urlencode
 from django.utils.translation import ugettext as _
@@ -11,7 +18,12 @@ from django.conf import settings
 from django.shortcuts import resolve_url
 from django.forms import ModelChoiceField, DateTimeField, DateField
 from django.utils.six.moves.urllib.parse import urlparse
-from django.db.models import Count
+from django.db import connections
+from django.db.models import Count, Q
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.functional import cached_property
+from django.core.cache import cache
+from django.core.paginator import Paginator
 from django.db.models.fields.related import (
     ForeignKey, ManyToManyRel, ManyToOneRel)
 from django.contrib.auth import REDIRECT_FIELD_NAME
@@ -20,6 +32,267 @@ from datetimewidget.widgets import DateTimeWidget, DateWidget
 from autocomplete_light.forms import ModelForm
 
 from .forms import SavedSearchForm
+from .models import HStoreKey
+from .authentication import filter_perm
+from .decorators import versioned_key, bump_version
+
+
+def object_permissions(user, model, objs):
+    """
+    Returns the primary keys of the objects of a list which the user may
+    change and delete, as {'change': {pk, ...}, 'delete': {pk, ...}}, with a
+    single permission check of each kind for the whole list.
+    """
+    opts = model._meta
+    return {action: {obj.pk for obj in filter_perm(
+        user, '{}.{}_{}'.format(opts.app_label, action, opts.model_name),
+        objs)} for action in ('change', 'delete')}
+
+
+def explain(qs):
+    """
+    Returns the SQL query of a queryset, and the plan of the database for it.
+    """
+    sql, params = qs.query.sql_with_params()
+    with connections[qs.db].cursor() as cursor:
+        cursor.execute('EXPLAIN {}'.format(sql), params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+    return sql % tuple(repr(param) for param in params), plan
+
+
+PAGE_SIZES = (10, 25, 50, 100)
+EXACT_COUNT_THRESHOLD = 1000
+COUNT_CACHE_TIMEOUT = getattr(settings, 'COUNT_CACHE_TIMEOUT', 30)
+
+
+def estimate_count(qs):
+    """
+    Returns the number of rows the database planner expects for a queryset.
+    """
+    sql, params = qs.query.sql_with_params()
+    with connections[qs.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) {}'.format(sql), params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def invalidate_counts(model):
+    """
+    Forgets the cached counts of the querysets reading the table of a model.
+    The invalidation only reaches the processes sharing the cache, the
+    others keep their counts for COUNT_CACHE_TIMEOUT seconds at most.
+    """
+    bump_version('count-{}'.format(model._meta.db_table))
+
+
+def count_queryset(qs, approximate=False):
+    """
+    Counts the items of a queryset, and tells whether the count is exact.
+    Exact counts are cached per SQL query, until one of the tables it reads
+    is written (see invalidate_counts()) or for COUNT_CACHE_TIMEOUT seconds.
+    When `approximate` is set and the planner expects more than
+    EXACT_COUNT_THRESHOLD rows, its estimate is returned instead.
+    """
+    sql, params = qs.query.sql_with_params()
+    versions = [versioned_key('count-{}'.format(table))
+                for table in sorted({join.table_name
+                                     for join in qs.query.alias_map.values()})]
+    key = 'count-{}'.format(sha224((sql + repr(params) + repr(versions))
+                                   .encode()).hexdigest())
+    count = cache.get(key)
+    if count is not None:
+        return count, True
+    if approximate:
+        estimate = estimate_count(qs)
+        if estimate > EXACT_COUNT_THRESHOLD:
+            return estimate, False
+    count = qs.count()
+    cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count, True
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Page numbers paginator, with its exact count cached.
+    """
+    count_is_approximate = False
+
+    @cached_property
+    def count(self):
+        return count_queryset(self.object_list)[0]
+
+
+def keyset_ordering(qs):
+    """
+    Returns the ordering of a queryset as a list of (lookup, descending,
+    nullable) tuples ending with the primary key, or None if it cannot be
+    used as a pagination cursor (random or raw SQL ordering, or ordering on
+    a relation).
+    """
+    if qs.query.extra_order_by:
+        return None
+    terms = qs.query.order_by or qs.model._meta.ordering
+    ordering = []
+    for term in terms:
+        if not isinstance(term, str) or term == '?':
+            return None
+        lookup = term.lstrip('-')
+        descending = term.startswith('-')
+        if lookup in ('pk', qs.model._meta.pk.name):
+            ordering.append(('pk', descending, False))
+            break
+        if lookup in qs.query.annotations:
+            ordering.append((lookup, descending, True))
+            continue
+        if lookup in qs.query.extra_select or '.' in lookup:
+            return None
+        model = qs.model
+        nullable = False
+        try:
+            for name in lookup.split('__'):
+                field = model._meta.get_field(name)
+                nullable = nullable or field.null
+                model = field.rel.to if field.rel is not None else None
+        except (FieldDoesNotExist, AttributeError):
+            return None
+        if model is not None:
+            return None
+        ordering.append((lookup, descending, nullable))
+    else:
+        ordering.append(('pk', False, False))
+    return ordering
+
+
+class KeysetPage():
+    is_keyset = True
+
+    def __init__(self, paginator, object_list, has_previous, has_next):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and len(self.object_list) > 0
+
+    def has_next(self):
+        return self._has_next and len(self.object_list) > 0
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    @property
+    def previous_cursor(self):
+        return self.paginator.cursor_for(self.object_list[0])
+
+    @property
+    def next_cursor(self):
+        return self.paginator.cursor_for(self.object_list[-1])
+
+
+class KeysetPaginator():
+    """
+    Pages through a queryset from a cursor, the ordering values of the last
+    item of the previous page (or of the first item of the next one), instead
+    of an offset: deep pages are as fast as the first one, and pages don't
+    shift when items are added.
+    NULL values are sorted the PostgreSQL way: last in ascending order,
+    first in descending order.
+    """
+
+    def __init__(self, qs, per_page, ordering, approximate_count=False):
+        self.qs = qs
+        self.per_page = per_page
+        self.ordering = ordering
+        self.approximate_count = approximate_count
+
+    @cached_property
+    def _count(self):
+        return count_queryset(self.qs, self.approximate_count)
+
+    @property
+    def count(self):
+        return self._count[0]
+
+    @property
+    def count_is_approximate(self):
+        return not self._count[1]
+
+    def cursor_for(self, obj):
+        values = []
+        for lookup, descending, nullable in self.ordering:
+            value = obj
+            for name in lookup.split('__'):
+                value = getattr(value, name, None)
+            if isinstance(value, date):
+                value = value.isoformat()
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor):
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode())
+                            .decode())
+        if not isinstance(values, list) or \
+                len(values) != len(self.ordering):
+            raise ValueError('Invalid cursor.')
+        return values
+
+    def after(self, ordering, values):
+        """
+        Returns the filter on the items following the given ordering values.
+        """
+        queries = []
+        equal = Q()
+        for (lookup, descending, nullable), value in zip(ordering, values):
+            isnull = '{}__isnull'.format(lookup)
+            if value is None:
+                following = Q(**{isnull: False}) if descending else None
+                same = Q(**{isnull: True})
+            else:
+                following = Q(**{'{}__{}'.format(
+                    lookup, 'lt' if descending else 'gt'): value})
+                if nullable and not descending:
+                    following |= Q(**{isnull: True})
+                same = Q(**{lookup: value})
+            if following is not None:
+                queries.append(equal & following)
+            equal &= same
+        if len(queries) == 0:
+            return Q(pk__in=[])
+        return reduce(operator.or_, queries)
+
+    def page(self, after=None, before=None):
+        ordering = self.ordering
+        qs = self.qs
+        try:
+            if before is not None:
+                ordering = [(lookup, not descending, nullable)
+                            for lookup, descending, nullable in ordering]
+                qs = qs.filter(self.after(ordering,
+                                          self.decode_cursor(before)))
+            elif after is not None:
+                qs = qs.filter(self.after(ordering, self.decode_cursor(after)))
+        except (ValueError, TypeError):
+            after = before = None
+            ordering = self.ordering
+            qs = self.qs
+        qs = qs.order_by(*['{}{}'.format('-' if descending else '', lookup)
+                           for lookup, descending, nullable in ordering])
+        object_list = list(qs[:self.per_page + 1])
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if before is not None:
+            object_list.reverse()
+            return KeysetPage(self, object_list, has_more, True)
+        return KeysetPage(self, object_list, after is not None, has_more)
 
 
 class ForceResponse(Exception):
@@ -92,6 +365,9 @@ class PermissionMixin():
         return super().delete(*args, **kwargs)
 
     def get_object(self, **filters):
+        # views may call get_object() several times: check the object once
+        if len(filters) == 0 and hasattr(self, '_checked_object'):
+            return self._checked_object
         if len(filters) == 0:
             obj = super().get_object()
         else:
@@ -100,6 +376,8 @@ class PermissionMixin():
             resolved_login_url = resolve_url(settings.LOGIN_URL)
             path = self.request.build_absolute_uri()
             raise ForceResponse(redirect_to_login(path, resolved_login_url))
+        if len(filters) == 0:
+            self._checked_object = obj
         return obj
 
     def get_queryset(self):
@@ -154,6 +432,9 @@ class LatePermissionMixin():
             path, resolved_login_url, REDIRECT_FIELD_NAME)
 
     def get_object(self, **filters):
+        # views may call get_object() several times: check the object once
+        if len(filters) == 0 and hasattr(self, '_checked_object'):
+            return self._checked_object
         if len(filters) == 0:
             obj = super().get_object()
         else:
@@ -162,6 +443,8 @@ class LatePermissionMixin():
             resolved_login_url = resolve_url(settings.LOGIN_URL)
             path = self.request.build_absolute_uri()
             raise ForceResponse(redirect_to_login(path, resolved_login_url))
+        if len(filters) == 0:
+            self._checked_object = obj
         return obj
 
     def get_queryset(self):
@@ -259,7 +542,10 @@ class SearchFormMixin(generic.edit.FormMixin):
                 sign = '-'
             if '__' in order:
                 order = order[:order.find('__')]
-            if hasattr(model._meta, 'order_mapping')\
+            if hasattr(model._meta, 'counter_fields')\
+                    and order in model._meta.counter_fields:
+                qs = qs.order_by(sign + model._meta.counter_fields[order])
+            elif hasattr(model._meta, 'order_mapping')\
                     and order in model._meta.order_mapping:
                 qs = qs.order_by(sign + model._meta.order_mapping[order])
             elif order in model._meta.get_all_field_names():
@@ -280,27 +566,41 @@ class SearchFormMixin(generic.edit.FormMixin):
                         .order_by('{}count_order'.format(sign))
                     pass
                 elif isinstance(field, HStoreField):
-                    try:
-                        if self.order[0] == '-':
-                            order = self.order[1:]
-                            minus = '-'
-                        else:
-                            order = self.order
-                            minus = ''
-                        field, name = order.split('__')
-                        field_name = 'ordering_{}_{}'.format(
-                            field, slugify(name).replace('-', '_'))
-                        select = {field_name:
-                                  "{}.{}->'{}'".format(model._meta.db_table,
-                                                       field, name)}
-                        qs = qs.extra(select=select).order_by(
-                            '{}{}'.format(minus, field_name))
-                    except Exception as e:
-                        raise e
+                    field, name = self.order.lstrip('-').split('__', 1)
+                    field_name = 'ordering_{}_{}'.format(
+                        field, slugify(name).replace('-', '_'))
+                    qs = qs.annotate(**{field_name: HStoreKey(field, name)})\
+                        .order_by('{}{}'.format(sign, field_name))
                 else:
                     qs = qs.order_by(sign + order)
         return qs
 
+    paginator_class = CachedCountPaginator
+
+    def get_paginate_by(self, queryset):
+        """
+        Returns the page size chosen by the user, kept in their session.
+        """
+        size = self.request.GET.get('per_page', '')
+        if size.isdigit() and int(size) in PAGE_SIZES:
+            self.request.session['per_page'] = int(size)
+        return self.request.session.get('per_page', self.paginate_by)
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginates with a cursor when the ordering of the queryset allows it,
+        and with page numbers otherwise.
+        """
+        ordering = keyset_ordering(queryset)
+        if ordering is None or 'page' in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        # unfiltered lists are the largest: an estimate is enough for them
+        paginator = KeysetPaginator(queryset, page_size, ordering,
+                                    not self.form.is_submitted())
+        page = paginator.page(after=self.request.GET.get('after'),
+                              before=self.request.GET.get('before'))
+        return (paginator, page, page.object_list, page.has_other_pages())
+
     def get(self, request, *args, **kwargs):
         # From ProcessFormMixin
         form_class = self.get_form_class()
@@ -340,6 +640,11 @@ class SearchFormMixin(generic.edit.FormMixin):
                 context['querystring_without_order'] += '&'
         else:
             context['querystring_without_order'] = ''
+        context['page_sizes'] = PAGE_SIZES
+        if getattr(settings, 'SEARCH_EXPLAIN', False) and \
+                self.form.is_submitted():
+            context['search_sql'], context['search_plan'] = \
+                explain(self.object_list)
         if self.form.is_submitted():
             context['add_search_form'] = SavedSearchForm()
             context['saved_search_url'] = resolve_url(
@@ -355,6 +660,8 @@ class ListView(LoginRequiredMixin, PermissionMixin, generic.ListView):
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
         context['model'] = self.get_model()._meta.model_name
+        context['allowed'] = object_permissions(
+            self.request.user, self.get_model(), context['object_list'])
         return context
 
 
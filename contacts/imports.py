@@ -0,0 +1,184 @@
+import io
+import re
+import csv
+import codecs
+from functools import lru_cache
+from itertools import chain
+
+import chardet
+from chardet.universaldetector import UniversalDetector
+
+
+READ_SIZE = 64 * 1024
+DETECTION_SIZE = 1024 * 1024
+SNIFF_SIZE = 64 * 1024
+REENCODE_CACHE_SIZE = 4096
+# bytes kept as surrogates by the 'surrogateescape' error handler
+ESCAPED_BYTES = re.compile('[\udc80-\udcff]')
+
+
+class ChunksIO(io.RawIOBase):
+    """
+    Read-only raw stream over an iterable of bytes chunks, so that the
+    standard text layer handles incremental decoding and line splitting.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while len(self.pending) == 0:
+            try:
+                self.pending = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+
+def read_chunks(file, size=READ_SIZE):
+    """
+    Iterates through a file by chunks of `size` bytes.
+    """
+    while True:
+        chunk = file.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def detect_encoding(chunks):
+    """
+    Guesses the encoding of a stream from its first chunks (up to
+    DETECTION_SIZE bytes).
+    Returns the chardet detection and an iterator over the whole stream,
+    including the chunks consumed by the detection.
+    As the rest of the stream may not be ASCII, an ASCII head is reported
+    as UTF-8; the bytes which can't be decoded with the detected encoding
+    are repaired by reencode_data() (see read_csv()).
+    """
+    chunks = iter(chunks)
+    detector = UniversalDetector()
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        detector.feed(chunk)
+        if detector.done or size >= DETECTION_SIZE:
+            break
+    detector.close()
+    result = dict(detector.result)
+    if result['encoding'] == 'ascii':
+        result['encoding'] = 'utf-8'
+    return result, chain(head, chunks)
+
+
+def read_csv(chunks, detection):
+    """
+    Returns a DictReader over a stream of bytes chunks, decoded with the
+    detected encoding. The CSV dialect is sniffed on the first SNIFF_SIZE
+    bytes only.
+    With `errors='surrogateescape'` in the detection, bytes which can't be
+    decoded are kept as surrogates, for reencode_data() to decode them.
+    """
+    chunks = iter(chunks)
+    head = []
+    size = 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= SNIFF_SIZE:
+            break
+    sample = b''.join(head).decode(detection['encoding'], errors='ignore')
+    if size >= SNIFF_SIZE and '\n' in sample:
+        # don't let a truncated row mislead the sniffer
+        sample = sample[:sample.rfind('\n')]
+    dialect = csv.Sniffer().sniff(sample)
+    if dialect.escapechar is None:
+        dialect.escapechar = '\\'  # hack
+    raw_stream = io.BufferedReader(ChunksIO(chain(head, chunks)))
+    stream = io.TextIOWrapper(raw_stream, encoding=detection['encoding'],
+                              errors=detection.get('errors', 'strict'),
+                              newline='')
+    return csv.DictReader(stream, dialect=dialect)
+
+
+@lru_cache(maxsize=REENCODE_CACHE_SIZE)
+def guess_cell(raw, encoding):
+    """
+    Decodes the raw bytes of a cell which is neither valid UTF-8 nor known to
+    be in the file encoding, using chardet. Decisions are cached, as the same
+    values tend to come back (company names, types…).
+    """
+    det = chardet.detect(raw)
+    if det['encoding'] is not None and det['confidence'] > .5:
+        try:
+            return raw.decode(det['encoding'])
+        except (LookupError, UnicodeDecodeError):
+            pass
+    return raw.decode(encoding, errors='replace')
+
+
+def reencode_data(reader, detection):
+    """
+    Iterates through a reader (an iterable of dicts) and re-encode each value,
+    with encoding guessing.
+    Values are decoded with the file encoding, but such files often hold
+    UTF-8 cells too. The decision is taken per column, from its non-ASCII
+    cells: UTF-8 cells are decoded as such, and other cells are left as they
+    are, unless the column has been flagged as mixing both, in which case
+    they go through chardet.
+    Cells holding bytes which couldn't be decoded (see read_csv()) go through
+    chardet too.
+    """
+    encoding = detection['encoding']
+    errors = detection.get('errors', 'strict')
+    if encoding is None or\
+            codecs.lookup(encoding).name in ('utf-8', 'ascii'):
+        for row in reader:
+            row = {k: v for k, v in row.items()
+                   if k is not None and v is not None}
+            if errors == 'surrogateescape':
+                for key, value in row.items():
+                    if ESCAPED_BYTES.search(value):
+                        row[key] = guess_cell(
+                            value.encode('utf-8', errors), 'cp1252')
+            yield row
+        return
+
+    columns = {}
+    for row in reader:
+        reencoded_row = {}
+        for key, value in row.items():
+            if key is None or value is None:
+                continue
+            if value == '' or max(value) < '\x80':  # ASCII
+                reencoded_row[key] = value
+                continue
+            raw = value.encode(encoding, errors)
+            state = columns.get(key)
+            try:
+                reencoded_row[key] = raw.decode('utf-8')
+                if state is None:
+                    columns[key] = 'utf-8'
+                elif state == 'native':
+                    columns[key] = 'mixed'
+            except UnicodeDecodeError:
+                if state is None:
+                    columns[key] = state = 'native'
+                elif state == 'utf-8':
+                    columns[key] = state = 'mixed'
+                if state == 'native' and not (
+                        errors == 'surrogateescape' and
+                        ESCAPED_BYTES.search(value)):
+                    reencoded_row[key] = value
+                else:
+                    reencoded_row[key] = guess_cell(raw, encoding)
+        yield reencoded_row
@@ -0,0 +1,90 @@
+import time
+import random
+
+from django.core.management.base import BaseCommand
+import chardet
+
+from contacts.imports import read_csv, reencode_data, guess_cell
+
+
+NAMES = ['Émile', 'Hélène', 'François', 'Jérôme', 'Anaïs', 'Noël', 'Jean',
+         'Paul', 'Marie', 'Bérénice']
+COMPANIES = ['Société Générale', 'Crédit Agricole', 'Les Échos', 'ACME',
+             'Électricité de France', 'Orange']
+
+
+def legacy_reencode_data(reader, detection):
+    """
+    The per-cell chardet implementation of reencode_data, as it was before
+    the per-column decisions. Cells it cannot decode are counted as errors
+    instead of aborting the import.
+    """
+    errors = 0
+    data = []
+    for row in reader:
+        reencoded_row = {}
+        for key, value in row.items():
+            if key is not None and value is not None:
+                det = chardet.detect(value.encode())
+                try:
+                    if det['encoding'] != detection['encoding']\
+                            and det['confidence'] > .5\
+                            and detection['encoding'] != 'utf-8':
+                        reencoded_row[key] = value.encode(
+                            detection['encoding']).decode(det['encoding'])
+                    else:
+                        reencoded_row[key] = value.encode(
+                            detection['encoding']).decode()
+                except (UnicodeEncodeError, UnicodeDecodeError):
+                    errors += 1
+        data.append(reencoded_row)
+    return data, errors
+
+
+def mixed_fixture(rows):
+    """
+    Builds a latin-1 CSV file where one column out of three holds UTF-8
+    encoded values, and the comments mix both encodings.
+    """
+    lines = ['firstname;lastname;company;comments\n'.encode('latin-1')]
+    for i in range(rows):
+        firstname = random.choice(NAMES).encode('latin-1')
+        lastname = random.choice(NAMES).upper().encode('latin-1')
+        company = random.choice(COMPANIES).encode('utf-8')
+        comment = 'Échange n°{} à propos de la réunion'.format(i)
+        comment = comment.encode('utf-8' if i % 2 else 'latin-1')
+        lines.append(b';'.join([firstname, lastname, company, comment])
+                     + b'\n')
+    return lines
+
+
+class Command(BaseCommand):
+    help = 'Compares the re-encoding of CSV imports with the per-cell ' \
+        'chardet implementation, on a mixed latin-1/UTF-8 file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        chunks = mixed_fixture(options['rows'])
+        detection = {'encoding': 'ISO-8859-1', 'confidence': 1}
+
+        start = time.perf_counter()
+        data, errors = legacy_reencode_data(read_csv(chunks, detection),
+                                            detection)
+        legacy = time.perf_counter() - start
+        self.stdout.write('per-cell chardet : {:.3f} s for {} rows '
+                          '({} undecodable cells)'
+                          .format(legacy, len(data), errors))
+
+        guess_cell.cache_clear()
+        start = time.perf_counter()
+        data = list(reencode_data(read_csv(chunks, detection), detection))
+        current = time.perf_counter() - start
+        self.stdout.write('per-column       : {:.3f} s for {} rows '
+                          '(chardet cache: {})'
+                          .format(current, len(data),
+                                  guess_cell.cache_info()))
+        self.stdout.write('speedup          : x{:.1f}'
+                          .format(legacy / current if current else 0))
@@ -0,0 +1,81 @@
+import time
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from contacts.forms import ContactSearchForm, MeetingSearchForm
+from contacts.models import Contact, Meeting
+
+TRIGRAM_INDEXES = ('contacts_contact_firstname_trgm',
+                   'contacts_contact_lastname_trgm',
+                   'contacts_company_name_trgm')
+
+
+class Rollback(Exception):
+    pass
+
+
+def search_terms(count):
+    """
+    Picks substrings of existing names and companies, as users would type
+    them.
+    """
+    names = list(Contact.objects.order_by('?')
+                 .values_list('lastname', 'company__name')[:count])
+    terms = []
+    for lastname, company in names:
+        value = random.choice([v for v in (lastname, company) if v] or [''])
+        if len(value) > 3:
+            start = random.randrange(len(value) - 3)
+            value = value[start:start + random.randint(3, 6)]
+        terms.append(value)
+    return terms
+
+
+def percentile(timings, ratio):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * ratio))]
+
+
+class Command(BaseCommand):
+    help = 'Measures the latency of contacts and meetings searches, with ' \
+        'and without the trigram indexes. The indexes are dropped in a ' \
+        'transaction which is rolled back, but which locks the tables: ' \
+        'do not run this on a production database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--searches', type=int, default=100)
+
+    def run(self, terms):
+        timings = []
+        for term in terms:
+            for form_class, model, field in (
+                    (ContactSearchForm, Contact, 'name'),
+                    (ContactSearchForm, Contact, 'company'),
+                    (MeetingSearchForm, Meeting, 'contact')):
+                form = form_class(data={field: term})
+                start = time.perf_counter()
+                len(form.search(model.objects.all())[:50])
+                timings.append(time.perf_counter() - start)
+        return timings
+
+    def report(self, label, timings):
+        self.stdout.write('{:<16}: p50 {:.1f} ms, p95 {:.1f} ms '
+                          '({} searches)'.format(
+                              label, percentile(timings, .5) * 1000,
+                              percentile(timings, .95) * 1000, len(timings)))
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        terms = search_terms(options['searches'])
+        self.report('with indexes', self.run(terms))
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for index in TRIGRAM_INDEXES:
+                        cursor.execute('DROP INDEX {}'.format(index))
+                self.report('without indexes', self.run(terms))
+                raise Rollback()
+        except Rollback:
+            pass
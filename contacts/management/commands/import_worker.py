@@ -0,0 +1,78 @@
+import time
+import logging
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from contacts.models import (ImportJob, properties_version,
+                             sync_property_indexes)
+
+logger = logging.getLogger(__name__)
+
+
+def sync_indexes(version):
+    """
+    Syncs the indexes on the properties displayed on the lists if the
+    properties changed since the given version. Returns the synced version.
+    """
+    current = properties_version()
+    if current == version:
+        return version
+    try:
+        created, dropped = sync_property_indexes()
+    except Exception as e:
+        logger.exception('Échec de la synchronisation des index ({} : {})'
+                         .format(type(e).__name__, e))
+        return version
+    if created or dropped:
+        logger.info('{} index créés, {} index supprimés'
+                    .format(created, dropped))
+    return current
+
+
+def work(poll_interval, once, shards):
+    indexes_version = None
+    while True:
+        indexes_version = sync_indexes(indexes_version)
+        job = ImportJob.claim()
+        if job is not None:
+            job.run(shards=shards)
+        if once:
+            return
+        if job is None:
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Runs the pending import jobs, in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2,
+                            help='seconds to wait when no job is pending')
+        parser.add_argument('--shards', type=int, default=1,
+                            help='number of processes for each contacts or '
+                            'meetings import, rows being split by company')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='run a single job per process, then exit')
+
+    def handle(self, *args, **options):
+        if options['processes'] <= 1:
+            work(options['poll_interval'], options['once'],
+                 options['shards'])
+            return
+
+        # each process has to open its own database connection
+        for connection in connections.all():
+            connection.close()
+        processes = [multiprocessing.Process(target=work,
+                                             args=(options['poll_interval'],
+                                                   options['once'],
+                                                   options['shards']))
+                     for i in range(options['processes'])]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from contacts.counters import refresh_counters
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the contacts, meetings and open alerts counters ' \
+        'maintained by the database triggers.'
+
+    def handle(self, *args, **options):
+        refresh_counters()
+        self.stdout.write('Compteurs mis à jour.')
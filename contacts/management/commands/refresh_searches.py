@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from contacts.models import SavedSearch, SEARCH_COUNT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Counts the results of the saved searches whose items changed, '\
+        'and refreshes the stored results of the materialized ones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=SEARCH_COUNT_BATCH_SIZE,
+                            help='number of searches counted at once')
+        parser.add_argument('--interval', type=float, default=60,
+                            help='seconds to wait between two refreshes')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='refresh once, then exit')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='evaluate again all the items of the '
+                            'materialized searches')
+        parser.add_argument('--full-interval', type=float, default=86400,
+                            help='seconds between two full refreshes of '
+                            'the materialized searches')
+
+    def handle(self, *args, **options):
+        full_date = time.time()
+        while True:
+            counted = SavedSearch.refresh_counts(options['batch_size'])
+            if options['verbosity'] > 1:
+                self.stdout.write('{} recherches mises à jour'
+                                  .format(counted))
+            # changes to related items are only seen by full refreshes
+            full = options['full'] or \
+                time.time() - full_date >= options['full_interval']
+            if full:
+                full_date = time.time()
+            materialized = SavedSearch.refresh_materialized(full)
+            if options['verbosity'] > 1:
+                self.stdout.write('{} recherches enregistrées mises à jour'
+                                  .format(materialized))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
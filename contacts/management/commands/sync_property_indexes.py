@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from contacts.models import sync_property_indexes
+
+
+class Command(BaseCommand):
+    help = 'Creates the indexes on the properties displayed on the lists, '\
+        'and drops the ones which are no longer displayed (this is also '\
+        'done by the import workers when the properties change).'
+
+    def handle(self, *args, **options):
+        created, dropped = sync_property_indexes()
+        if options['verbosity'] > 1 or created or dropped:
+            self.stdout.write('{} index créés, {} index supprimés'
+                              .format(created, dropped))
@@ -4,16 +4,25 @@ from .models import DefaultGroup
 
 
 class DefaultGroupMiddleware:
+    """
+    Loads the default group of the user, with its group, in a single query
+    per request, so that later uses of `request.user.default_group` don't hit
+    the database. It is read from the database on each request, so that a
+    change made by another process is always seen.
+    """
 
     def process_request(self, request):
+        if not request.user.is_authenticated():
+            return
         try:
-            if request.user.is_authenticated():
-                request.user.default_group
+            default_group = DefaultGroup.objects.select_related('group')\
+                .get(user=request.user)
         except DefaultGroup.DoesNotExist:
             if request.user.groups.count() == 0:
                 group = Group(name=request.user.username)
                 group.save()
                 request.user.groups.add(group)
-            DefaultGroup.objects.create(
+            default_group = DefaultGroup.objects.create(
                 user=request.user,
                 group=request.user.groups.first())
+        request.user.default_group = default_group
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.hstore
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0006_require_contenttypes_0002'),
+        ('contacts', '0025_auto_20161102_1407'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', auto_created=True, serialize=False, primary_key=True)),
+                ('type', models.CharField(verbose_name='type', max_length=32, choices=[('Contact', 'contact'), ('Company', 'société'), ('Meeting', 'échange'), ('Alert', 'alerte')])),
+                ('file', models.FileField(verbose_name='fichier', upload_to='imports/%Y/%m/')),
+                ('encoding', models.CharField(verbose_name='encodage', max_length=32)),
+                ('mapping', django.contrib.postgres.fields.hstore.HStoreField(verbose_name='correspondance des champs', default={})),
+                ('properties', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), verbose_name='propriétés', null=True, blank=True, size=None)),
+                ('date_format', models.CharField(verbose_name='format des dates', max_length=64, blank=True)),
+                ('status', models.CharField(verbose_name='statut', max_length=16, choices=[('pending', 'en attente'), ('running', 'en cours'), ('done', 'terminé'), ('failed', 'échoué')], default='pending', db_index=True)),
+                ('rows_count', models.PositiveIntegerField(verbose_name='lignes lues', default=0)),
+                ('inserted_count', models.PositiveIntegerField(verbose_name='créations', default=0)),
+                ('updated_count', models.PositiveIntegerField(verbose_name='modifications', default=0)),
+                ('errors_count', models.PositiveIntegerField(verbose_name='erreurs', default=0)),
+                ('error', models.TextField(verbose_name='erreur', blank=True)),
+                ('start_date', models.DateTimeField(verbose_name='date de début', null=True, blank=True)),
+                ('end_date', models.DateTimeField(verbose_name='date de fin', null=True, blank=True)),
+                ('creation_date', models.DateTimeField(verbose_name='date de création', auto_now_add=True)),
+                ('update_date', models.DateTimeField(verbose_name='date de mise à jour', auto_now=True)),
+                ('author', models.ForeignKey(verbose_name='créateur', related_name='import_jobs', to=settings.AUTH_USER_MODEL)),
+                ('group', models.ForeignKey(verbose_name='groupe', related_name='import_jobs', to='auth.Group')),
+            ],
+            options={
+                'verbose_name': 'import',
+                'ordering': ['-creation_date'],
+                'get_latest_by': 'creation_date',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.contrib.postgres.operations import CreateExtension
+
+# icontains and iexact lookups compare UPPER("column"::text): the indexes are
+# built on that same expression so that the planner can use them
+INDEXED_COLUMNS = (
+    ('contacts_contact', 'firstname'),
+    ('contacts_contact', 'lastname'),
+    ('contacts_company', 'name'),
+)
+
+
+def create_index(table, column):
+    return 'CREATE INDEX {table}_{column}_trgm ON {table} USING gin ' \
+        '(UPPER({column}::text) gin_trgm_ops);'.format(table=table,
+                                                       column=column)
+
+
+def drop_index(table, column):
+    return 'DROP INDEX IF EXISTS {table}_{column}_trgm;'.format(
+        table=table, column=column)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0026_importjob'),
+    ]
+
+    operations = [
+        CreateExtension('pg_trgm'),
+    ] + [
+        migrations.RunSQL(create_index(table, column),
+                          reverse_sql=drop_index(table, column))
+        for table, column in INDEXED_COLUMNS
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.contrib.postgres.operations import UnaccentExtension
+
+# the search_vector columns are only known to the database: they are kept up
+# to date by triggers, and queried by SearchForm._apply_fulltext()
+INDEXED_TABLES = (
+    ('contacts_contact', ('comments', )),
+    ('contacts_company', ('comments', )),
+    ('contacts_meeting', ('comments', )),
+    ('contacts_alert', ('title', 'comments')),
+)
+
+CREATE_CONFIGURATION = '''
+CREATE TEXT SEARCH CONFIGURATION public.pyru_french
+    (COPY = pg_catalog.french);
+ALTER TEXT SEARCH CONFIGURATION public.pyru_french
+    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, french_stem;
+'''
+
+DROP_CONFIGURATION = 'DROP TEXT SEARCH CONFIGURATION public.pyru_french;'
+
+CREATE_VECTOR = '''
+ALTER TABLE {table} ADD COLUMN search_vector tsvector;
+UPDATE {table} SET search_vector = to_tsvector('public.pyru_french', {values});
+CREATE INDEX {table}_search_vector ON {table} USING gin (search_vector);
+CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE
+    tsvector_update_trigger(search_vector, 'public.pyru_french', {columns});
+'''
+
+DROP_VECTOR = '''
+DROP TRIGGER {table}_search_vector ON {table};
+ALTER TABLE {table} DROP COLUMN search_vector;
+'''
+
+
+def create_vector(table, columns):
+    values = " || ' ' || ".join("coalesce({}, '')".format(column)
+                                for column in columns)
+    return CREATE_VECTOR.format(table=table, values=values,
+                                columns=', '.join(columns))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0027_trigram_indexes'),
+    ]
+
+    operations = [
+        UnaccentExtension(),
+        migrations.RunSQL(CREATE_CONFIGURATION,
+                          reverse_sql=DROP_CONFIGURATION),
+    ] + [
+        migrations.RunSQL(create_vector(table, columns),
+                          reverse_sql=DROP_VECTOR.format(table=table))
+        for table, columns in INDEXED_TABLES
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# serve the @> and ? operators used by the properties search
+INDEXED_TABLES = ('contacts_contact', 'contacts_company')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0028_fulltext_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX {table}_properties_gin ON {table} '
+            'USING gin (properties);'.format(table=table),
+            reverse_sql='DROP INDEX {}_properties_gin;'.format(table))
+        for table in INDEXED_TABLES
+    ]
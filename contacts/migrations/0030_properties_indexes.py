@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from hashlib import sha1
+
+from django.db import migrations
+
+
+def index_name(type, name):
+    return 'contacts_{}_property_{}'.format(
+        type, sha1(name.encode()).hexdigest()[:12])
+
+
+def create_indexes(apps, schema_editor):
+    Properties = apps.get_model('contacts', 'Properties')
+    for type, name in Properties.objects.filter(display_on_list=True)\
+            .values_list('type', 'name').distinct():
+        schema_editor.execute('CREATE INDEX IF NOT EXISTS {} ON contacts_{} '
+                              '((properties -> %s))'
+                              .format(index_name(type, name), type), [name])
+
+
+def drop_indexes(apps, schema_editor):
+    Properties = apps.get_model('contacts', 'Properties')
+    for type, name in Properties.objects.values_list('type', 'name')\
+            .distinct():
+        schema_editor.execute('DROP INDEX IF EXISTS {}'.format(
+            index_name(type, name)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0029_properties_gin_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, reverse_code=drop_indexes),
+    ]
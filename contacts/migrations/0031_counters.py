@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# (trigger table, counted foreign key, counter table, counter column,
+#  condition on the counted rows)
+COUNTERS = (
+    ('contacts_contact', 'company_id', 'contacts_company', 'contacts_count',
+     'TRUE'),
+    ('contacts_meeting', 'contact_id', 'contacts_contact', 'meetings_count',
+     'TRUE'),
+    ('contacts_alert', 'contact_id', 'contacts_contact',
+     'open_alerts_count', 'NOT {row}.done'),
+)
+
+CREATE_TRIGGER = '''
+CREATE FUNCTION {counter}_trigger() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.{key} IS NOT NULL
+            AND {old_condition} THEN
+        UPDATE {target} SET {counter} = {counter} - 1 WHERE id = OLD.{key};
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.{key} IS NOT NULL
+            AND {new_condition} THEN
+        UPDATE {target} SET {counter} = {counter} + 1 WHERE id = NEW.{key};
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER {counter}_trigger AFTER INSERT OR UPDATE OR DELETE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE {counter}_trigger();
+'''
+
+REFRESH_COUNTERS = '''
+UPDATE contacts_company SET contacts_count = (
+    SELECT count(*) FROM contacts_contact
+    WHERE company_id = contacts_company.id);
+UPDATE contacts_contact SET meetings_count = (
+    SELECT count(*) FROM contacts_meeting
+    WHERE contact_id = contacts_contact.id), open_alerts_count = (
+    SELECT count(*) FROM contacts_alert
+    WHERE contact_id = contacts_contact.id AND NOT done);
+'''
+
+DROP_TRIGGER = '''
+DROP TRIGGER {counter}_trigger ON {table};
+DROP FUNCTION {counter}_trigger();
+'''
+
+def create_trigger(table, key, target, counter, condition):
+    return CREATE_TRIGGER.format(
+        table=table, key=key, target=target, counter=counter,
+        old_condition=condition.format(row='OLD'),
+        new_condition=condition.format(row='NEW'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0030_properties_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='contacts_count',
+            field=models.PositiveIntegerField(
+                editable=False, default=0, verbose_name='nombre de contacts'),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='meetings_count',
+            field=models.PositiveIntegerField(
+                editable=False, default=0, verbose_name='nombre d’échanges'),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='open_alerts_count',
+            field=models.PositiveIntegerField(
+                editable=False, default=0,
+                verbose_name='nombre d’alertes en cours'),
+        ),
+    ] + [
+        migrations.RunSQL(create_trigger(*counter),
+                          reverse_sql=DROP_TRIGGER.format(
+                              counter=counter[3], table=counter[0]))
+        for counter in COUNTERS
+    ] + [
+        migrations.RunSQL(REFRESH_COUNTERS,
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+# search_name holds the unaccented, lowercased name and company of a contact,
+# with a leading space so that « LIKE '% prefix%' » matches word prefixes,
+# using the trigram index
+CREATE_TRIGGERS = '''
+CREATE FUNCTION contacts_contact_search_name() RETURNS trigger AS $$
+BEGIN
+    NEW.search_name := ' ' || lower(unaccent(
+        NEW.firstname || ' ' || NEW.lastname || ' ' || coalesce(
+            (SELECT name FROM contacts_company WHERE id = NEW.company_id),
+            '')));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER contacts_contact_search_name
+    BEFORE INSERT OR UPDATE ON contacts_contact
+    FOR EACH ROW EXECUTE PROCEDURE contacts_contact_search_name();
+
+CREATE FUNCTION contacts_company_search_name() RETURNS trigger AS $$
+BEGIN
+    UPDATE contacts_contact SET search_name = ''
+        WHERE company_id = NEW.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER contacts_company_search_name
+    AFTER UPDATE OF name ON contacts_company
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE PROCEDURE contacts_company_search_name();
+
+UPDATE contacts_contact SET search_name = '';
+CREATE INDEX contacts_contact_search_name_trgm ON contacts_contact
+    USING gin (search_name gin_trgm_ops);
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER contacts_company_search_name ON contacts_company;
+DROP FUNCTION contacts_company_search_name();
+DROP TRIGGER contacts_contact_search_name ON contacts_contact;
+DROP FUNCTION contacts_contact_search_name();
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0031_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='search_name',
+            field=models.TextField(editable=False, default='',
+                                   verbose_name='nom normalisé'),
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, reverse_sql=DROP_TRIGGERS),
+    ]
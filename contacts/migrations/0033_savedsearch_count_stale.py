@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0032_contact_search_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedsearch',
+            name='count_stale',
+            field=models.BooleanField(
+                default=True, db_index=True,
+                verbose_name='nombre de résultats à recalculer'),
+        ),
+        migrations.AddField(
+            model_name='savedsearch',
+            name='count_date',
+            field=models.DateTimeField(
+                null=True, blank=True,
+                verbose_name='date du calcul du nombre de résultats'),
+        ),
+    ]
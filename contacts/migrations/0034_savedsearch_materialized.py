@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0033_savedsearch_count_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='savedsearch',
+            name='materialized',
+            field=models.BooleanField(
+                default=False, verbose_name='résultats enregistrés'),
+        ),
+        migrations.AddField(
+            model_name='savedsearch',
+            name='materialized_date',
+            field=models.DateTimeField(
+                null=True, blank=True,
+                verbose_name='date d’enregistrement des résultats'),
+        ),
+        migrations.CreateModel(
+            name='SavedSearchResult',
+            fields=[
+                ('id', models.AutoField(
+                    verbose_name='ID', serialize=False, auto_created=True,
+                    primary_key=True)),
+                ('object_id', models.PositiveIntegerField(
+                    verbose_name='identifiant')),
+                ('search', models.ForeignKey(
+                    verbose_name='recherche', related_name='results',
+                    to='contacts.SavedSearch')),
+            ],
+            options={
+                'verbose_name': 'résultat de recherche',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='savedsearchresult',
+            unique_together=set([('search', 'object_id')]),
+        ),
+    ]
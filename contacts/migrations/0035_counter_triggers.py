@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# (trigger table, counted foreign key, counter column, columns of the
+#  condition on the counted rows, condition)
+COUNTERS = (
+    ('contacts_contact', 'company_id', 'contacts_count', (), 'TRUE'),
+    ('contacts_meeting', 'contact_id', 'meetings_count', (), 'TRUE'),
+    ('contacts_alert', 'contact_id', 'open_alerts_count', ('done', ),
+     'NOT {row}.done'),
+)
+
+# updates only fire the trigger when the counted foreign key or the
+# condition change, instead of decrementing then incrementing the same
+# counter on each write of a counted row
+CREATE_TRIGGERS = '''
+DROP TRIGGER {counter}_trigger ON {table};
+CREATE TRIGGER {counter}_trigger AFTER INSERT OR DELETE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE {counter}_trigger();
+CREATE TRIGGER {counter}_update_trigger
+    AFTER UPDATE OF {columns} ON {table}
+    FOR EACH ROW WHEN (OLD.{key} IS DISTINCT FROM NEW.{key}
+                       OR ({old_condition}) IS DISTINCT FROM
+                       ({new_condition}))
+    EXECUTE PROCEDURE {counter}_trigger();
+'''
+
+DROP_TRIGGERS = '''
+DROP TRIGGER {counter}_update_trigger ON {table};
+DROP TRIGGER {counter}_trigger ON {table};
+CREATE TRIGGER {counter}_trigger AFTER INSERT OR UPDATE OR DELETE ON {table}
+    FOR EACH ROW EXECUTE PROCEDURE {counter}_trigger();
+'''
+
+
+def triggers_sql(sql, table, key, counter, columns, condition):
+    return sql.format(table=table, key=key, counter=counter,
+                      columns=', '.join((key, ) + columns),
+                      old_condition=condition.format(row='OLD'),
+                      new_condition=condition.format(row='NEW'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0034_savedsearch_materialized'),
+    ]
+
+    operations = [
+        migrations.RunSQL(triggers_sql(CREATE_TRIGGERS, *counter),
+                          reverse_sql=triggers_sql(DROP_TRIGGERS, *counter))
+        for counter in COUNTERS
+    ]
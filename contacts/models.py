@@ -1,24 +1,35 @@
 import sys
 import logging
-from datetime import datetime
+import multiprocessing
+from datetime import datetime, timedelta
+from hashlib import sha1
 from collections import OrderedDict
+from itertools import islice, chain
 
-from django.db import models, transaction
-from django.db.models import Q, options
+from django.conf import settings
+from django.db import models, transaction, connections
+from django.db.models import Q, F, Func, Case, When, Value, options
 from django.utils import timezone
 from django.utils.text import slugify
 from django.core.urlresolvers import reverse
+from django.core.cache import cache
 from django.contrib.auth.models import User, Group
 from django.contrib.postgres import fields
 from markdown import markdown
 import bleach
 from dateutil import parser
 
-from .decorators import method_cache, classmethod_cache
+from .decorators import (method_cache, classmethod_cache, versioned_key,
+                         bump_version)
+from .imports import read_chunks, read_csv, reencode_data
+from . import typeahead
 
 
 options.DEFAULT_NAMES = options.DEFAULT_NAMES + ('words', 'order_mapping',
-                                                 'select_related', )
+                                                 'select_related',
+                                                 'export_fields',
+                                                 'import_fields',
+                                                 'counter_fields', )
 
 PROP_CHOICES = (('company', 'société'),
                 ('contact', 'contact'),
@@ -36,8 +47,60 @@ SEARCH_CHOICES = (('Contact', 'contact'),
                   ('Alert', 'alerte'),
                   )
 
+# types of the saved searches whose results depend on each type of items,
+# through the fields they search (e.g. the name of the company of a contact)
+SEARCH_DEPENDENCIES = {'Company': ('Company', 'Contact', 'Meeting', 'Alert'),
+                       'Contact': ('Contact', 'Meeting', 'Alert'),
+                       'Meeting': ('Meeting', ),
+                       'Alert': ('Alert', ),
+                       }
+
+JOB_STATUSES = (('pending', 'en attente'),
+                ('running', 'en cours'),
+                ('done', 'terminé'),
+                ('failed', 'échoué'),
+                )
+
 ALLOWED_TAGS = bleach.ALLOWED_TAGS + ['p', 'pre']
 
+IMPORT_BATCH_SIZE = 500
+IMPORT_JOB_TIMEOUT = getattr(settings, 'IMPORT_JOB_TIMEOUT', 600)
+PROPERTY_INDEXES_LOCK = 0x7079727500  # advisory lock of the indexes sync
+EXPORT_CHUNK_SIZE = 2000
+SEARCH_COUNT_BATCH_SIZE = 100
+SEARCH_MENU_CACHE_TIMEOUT = getattr(settings, 'SEARCH_MENU_CACHE_TIMEOUT',
+                                    30)
+COMBINE_LOOKAHEAD = 1000
+
+
+def chunks(iterable, size):
+    """ Splits an iterable into lists of at most `size` items. """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def bulk_update(model, objects, fields):
+    """ Writes the given fields of a list of saved objects with a single
+    UPDATE query, using one CASE expression per field. The column itself is
+    the default of each CASE, which gives its type to NULL values.
+    """
+    if len(objects) == 0:
+        return 0
+    values = {}
+    for field_name in fields:
+        field = model._meta.get_field(field_name)
+        whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname),
+                                            output_field=field))
+                 for obj in objects]
+        values[field.attname] = Case(*whens, default=F(field.attname),
+                                     output_field=field)
+    return model.objects.filter(pk__in=[obj.pk for obj in objects])\
+        .update(**values)
+
 
 def apply_mapping(row, mapping):
     mapped_row = {}
@@ -61,26 +124,61 @@ def combine_rows(data, mapping):
     Contact references.
     The goal is to create a flat list ofrows, each one containing the Contact
     and the Meeting.
+    Rows are streamed: a file is considered as a Saru one if a meeting-row
+    shows up in its first COMBINE_LOOKAHEAD rows.
     """
     default_mapping = {'firstname': 'firstname', 'lastname': 'lastname',
                        'company': 'company'}
     default_mapping.update(mapping)
     mapping = default_mapping
-    combined = []
-    fk_row = {}
-    for row in data:
+    data = iter(data)
+    head = list(islice(data, COMBINE_LOOKAHEAD))
+
+    def is_fk_row(row):
         # is this row a header (FK-row)?
-        if row[mapping['firstname']] + row[mapping['lastname']] != '':
+        return row[mapping['firstname']] + row[mapping['lastname']] != ''
+
+    if all(is_fk_row(row) for row in head):
+        yield from head
+        yield from data
+        return
+    fk_row = {}
+    for row in chain(head, data):
+        if is_fk_row(row):
             fk_row = {mapping['firstname']: row.get(mapping['firstname'], ''),
                       mapping['lastname']: row.get(mapping['lastname'], ''),
                       mapping['company']: row.get(mapping['company'], ''),
                       }
         else:
             row.update(fk_row)
-            combined.append(row)
-    if len(combined) == 0:
-        return data
-    return combined
+            yield row
+
+
+def preloaded(data, preloads, batch_size=IMPORT_BATCH_SIZE):
+    """ Iterates through the rows, filling import caches chunk by chunk
+    before handing the rows out.
+    `preloads` is a list of (ImportCache, function) couples, the function
+    returning the list of cache items referenced by a row.
+    """
+    for chunk in chunks(data, batch_size):
+        for cache, items in preloads:
+            cache.preload(item for row in chunk for item in items(row))
+        yield from chunk
+
+
+def property_names(row, mapping, fields, properties=None):
+    """ Returns the names of the properties held by a row: its columns which
+    are not mapped to one of the imported `fields` of the model, restricted
+    to `properties` unless it is None.
+    """
+    rev_mapping = {v: k for k, v in mapping.items()}
+    names = []
+    for column in row:
+        name = rev_mapping.get(column, column)
+        if name is not None and name not in fields and\
+                (properties is None or name in properties):
+            names.append(name)
+    return names
 
 
 class DataImportError(Exception):
@@ -96,15 +194,32 @@ class ImportCache:
         self.logger = logger
         self.key = key
         self.items = {}
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+
+    def _hash(self, item):
+        if isinstance(item, dict):
+            return tuple(sorted(item.items()))
+        return item
+
+    def _create_args(self, item):
+        if isinstance(item, dict):
+            args = item.copy()
+            args.update({'author': self.user,
+                         'group': self.group})
+        else:
+            args = {self.key: item,
+                    'author': self.user,
+                    'group': self.group}
+        return args
 
     def get(self, item):
         if item is None or item == '':
             return None
-        if isinstance(item, dict):
-            item_hash = tuple(item.items())
-        else:
-            item_hash = item
+        item_hash = self._hash(item)
         if item_hash not in self.items.keys():
+            self.misses += 1
             # TODO: check permissions!
             try:
                 if isinstance(item, dict):
@@ -113,25 +228,278 @@ class ImportCache:
                     args = {self.key: item}
                 obj = self.model.get_queryset(self.user)\
                     .get(**args)
-                self.logger.debug('Récupération de {} : {}'
+                self.logger.debug('Récupération de {} : {}'
                                   .format(self.model._meta.verbose_name,
                                           obj))
             except self.model.DoesNotExist:
-                if isinstance(item, dict):
-                    args = item.copy()
-                    args.update({'author': self.user,
-                                 'group': self.group})
-                else:
-                    args = {self.key: item,
-                            'author': self.user,
-                            'group': self.group}
-                obj = self.model.objects.create(**args)
-                self.logger.info('Création de {} : {}'
+                obj = self.model.objects.create(**self._create_args(item))
+                self.created += 1
+                self.logger.info('Création de {} : {}'
                                  .format(self.model._meta.verbose_name, obj))
             # obj = self.model.objects.get_or_create(**args)
             self.items[item_hash] = obj
+        else:
+            self.hits += 1
         return self.items[item_hash]
 
+    def preload(self, items):
+        """ Fills the cache for a whole set of items: the existing objects
+        are fetched with a single `filter(<key>__in=...)` per set of other
+        attributes (e.g. the type of properties), and the missing ones are
+        created with a single `bulk_create`.
+        Dict items must hold the `key` attribute.
+        """
+        names = OrderedDict()
+        for item in items:
+            if item is None or item == '' or\
+                    self._hash(item) in self.items.keys():
+                continue
+            if isinstance(item, dict):
+                args = item.copy()
+                name = args.pop(self.key)
+            else:
+                args = {}
+                name = item
+            names.setdefault(tuple(sorted(args.items())), set()).add(name)
+
+        for args, group_names in names.items():
+            qs = self.model.get_queryset(self.user).filter(**dict(args))
+            lookup = '{}__in'.format(self.key)
+            self._store(qs.filter(**{lookup: group_names}), args)
+            missing = [name for name in group_names
+                       if self._hash(self._item(name, args))
+                       not in self.items.keys()]
+            if len(missing) == 0:
+                continue
+            objs = []
+            for name in missing:
+                obj = self.model(**self._create_args(self._item(name, args)))
+                if hasattr(obj, 'make_slug'):
+                    obj.slug = obj.make_slug()
+                objs.append(obj)
+            try:
+                with transaction.atomic():
+                    self.model.objects.bulk_create(objs)
+            except Exception as e:
+                # leave them to get(), which will report them row by row
+                self.logger.warning('Échec de la création groupée de {} '
+                                    '({} : {})'
+                                    .format(self.model._meta.verbose_name,
+                                            e.__class__.__name__, e))
+                continue
+            self.created += len(objs)
+            self.logger.info('Création de {} {} : {}'
+                             .format(len(objs),
+                                     self.model._meta.verbose_name_plural,
+                                     ', '.join(str(obj) for obj in objs)))
+            # bulk_create does not set the primary keys
+            self._store(qs.filter(**{lookup: missing}), args)
+
+    def _item(self, name, args):
+        if len(args) == 0:
+            return name
+        item = dict(args)
+        item[self.key] = name
+        return item
+
+    def _store(self, qs, args):
+        for obj in qs:
+            item = self._item(getattr(obj, self.key), args)
+            self.items[self._hash(item)] = obj
+
+    def log_stats(self):
+        self.logger.debug('Cache de {} : {} trouvés, {} manquants, {} créés'
+                          .format(self.model._meta.verbose_name_plural,
+                                  self.hits, self.misses, self.created))
+
+
+class QuerysetExport:
+    """ Streams the rows of a queryset for export, as tuples matching
+    `header`.
+    Columns come from the `export_fields` Meta option of the model, and are
+    fetched with one values_list() query per chunk, the joins being done by
+    the database: no model instance is built. Chunks follow the ordering of
+    the queryset, paged with a keyset cursor (by primary key when this
+    ordering cannot be used as a cursor). Each column is then formatted in a
+    single pass.
+    """
+
+    def __init__(self, qs, chunk_size=EXPORT_CHUNK_SIZE):
+        self.qs = qs
+        self.model = qs.model
+        self.fields = OrderedDict(self.model._meta.export_fields)
+        self.chunk_size = chunk_size
+        self.with_properties = 'properties' in \
+            self.model._meta.get_all_field_names()
+        self._properties = None
+
+    @property
+    def properties(self):
+        """ Names of the property columns: every key used by at least one
+        row of the queryset, fetched with a single DISTINCT skeys() query so
+        that the header is known before streaming.
+        """
+        if self._properties is None:
+            keys = self.qs.order_by().annotate(
+                property_key=Func(F('properties'), function='skeys',
+                                  output_field=models.TextField()))\
+                .values_list('property_key', flat=True).distinct()
+            self._properties = sorted(keys)
+        return self._properties
+
+    @property
+    def header(self):
+        header = list(self.fields.keys())
+        if self.with_properties:
+            header += self.properties
+        return header
+
+    def get_field(self, lookup):
+        model = self.model
+        path = lookup.split('__')
+        for name in path[:-1]:
+            model = model._meta.get_field(name).rel.to
+        return model._meta.get_field(path[-1])
+
+    def get_formatters(self):
+        formatters = []
+        for lookup in self.fields.values():
+            field = self.get_field(lookup)
+            if isinstance(field, models.BooleanField):
+                formatters.append(int)
+            elif isinstance(field, models.DateField):
+                formatters.append(lambda value: value.isoformat())
+            else:
+                formatters.append(None)
+        return formatters
+
+    def __iter__(self):
+        from .generic import KeysetPaginator, keyset_ordering
+        formatters = self.get_formatters()
+        # the rows keep the ordering of the queryset, the values of its
+        # columns being the cursor of the next chunk
+        ordering = keyset_ordering(self.qs) or [('pk', False, False)]
+        lookups = [lookup for lookup, descending, nullable in ordering]
+        keys = len(lookups)
+        lookups += list(self.fields.values())
+        if self.with_properties:
+            properties = self.properties
+            lookups.append('properties')
+        paginator = KeysetPaginator(self.qs, self.chunk_size, ordering)
+        qs = self.qs.order_by(*['{}{}'.format('-' if descending else '',
+                                              lookup)
+                                for lookup, descending, nullable in ordering])\
+            .values_list(*lookups)
+        last = None
+        while True:
+            if last is not None:
+                chunk = list(qs.filter(paginator.after(ordering, last))
+                             [:self.chunk_size])
+            else:
+                chunk = list(qs[:self.chunk_size])
+            if len(chunk) == 0:
+                return
+            last = chunk[-1][:keys]
+            columns = list(zip(*chunk))[keys:]
+            for i, formatter in enumerate(formatters):
+                columns[i] = ['' if value is None else
+                              value if formatter is None else
+                              formatter(value)
+                              for value in columns[i]]
+            if self.with_properties:
+                values = columns.pop()
+                for name in properties:
+                    columns.append([(value or {}).get(name, '')
+                                    for value in values])
+            yield from zip(*columns)
+            if len(chunk) < self.chunk_size:
+                return
+
+
+def counted_update_fields(obj):
+    """
+    Returns the fields to write when updating an object, that is all but
+    the counters maintained by the database (see the counter_fields Meta
+    option), which would otherwise be overwritten with stale values.
+    """
+    counters = getattr(obj._meta, 'counter_fields', {}).values()
+    return [field.name for field in obj._meta.concrete_fields
+            if not field.primary_key and field.name not in counters]
+
+
+class HStoreKey(Func):
+    """
+    Value of a key of an hstore column, as the (column -> 'key') expression
+    the properties indexes are built on.
+    """
+
+    def __init__(self, field, key):
+        super().__init__(F(field), output_field=models.TextField())
+        self.key = key
+
+    def as_sql(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return '({} -> %s)'.format(sql), params + [self.key]
+
+
+def property_index_name(type, name):
+    return 'contacts_{}_property_{}'.format(
+        type, sha1(name.encode()).hexdigest()[:12])
+
+
+def properties_version(using='default'):
+    """
+    Returns a value which changes whenever a property is added, updated (such
+    as its display on the lists toggled) or deleted.
+    """
+    return tuple(Properties.objects.using(using).aggregate(
+        models.Count('pk'), models.Max('update_date')).values())
+
+
+def sync_property_indexes(using='default'):
+    """
+    Creates the indexes on the properties of companies or contacts displayed
+    on the lists of at least one group, so that these lists can be ordered by
+    them, and drops the other ones. Indexes are built concurrently, without
+    locking the tables, hence outside of any transaction: this is run by the
+    import workers when the properties change (see properties_version()),
+    not when they are saved. Concurrent runs are skipped.
+    Returns the numbers of created and dropped indexes.
+    """
+    displayed = {property_index_name(type, name): (type, name)
+                 for type, name in Properties.objects.using(using)
+                 .filter(display_on_list=True)
+                 .values_list('type', 'name').distinct()}
+    created = dropped = 0
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)',
+                       [PROPERTY_INDEXES_LOCK])
+        if not cursor.fetchone()[0]:
+            return created, dropped
+        try:
+            # builds which failed leave invalid indexes behind
+            cursor.execute('SELECT c.relname, i.indisvalid FROM pg_index i '
+                           'JOIN pg_class c ON c.oid = i.indexrelid '
+                           'WHERE c.relname LIKE %s',
+                           [r'contacts\_%\_property\_%'])
+            existing = dict(cursor.fetchall())
+            for index, valid in existing.items():
+                if index not in displayed or not valid:
+                    cursor.execute('DROP INDEX CONCURRENTLY IF EXISTS {}'
+                                   .format(index))
+                    dropped += 1
+            for index, (type, name) in displayed.items():
+                if not existing.get(index, False):
+                    cursor.execute('CREATE INDEX CONCURRENTLY {} ON {}_{} '
+                                   '((properties -> %s))'
+                                   .format(index, Properties._meta.app_label,
+                                           type), [name])
+                    created += 1
+        finally:
+            cursor.execute('SELECT pg_advisory_unlock(%s)',
+                           [PROPERTY_INDEXES_LOCK])
+    return created, dropped
+
 
 class DefaultGroup(models.Model):
     user = models.OneToOneField(User, related_name='default_group')
@@ -165,7 +533,7 @@ class Properties(models.Model):
         return self.name
 
     def is_owned(self, user, perm=None):
-        return self.contact.group.id == user.default_group.group_id
+        return self.group_id == user.default_group.group_id
 
     @classmethod
     def get_queryset(cls, user, qs=None):
@@ -231,7 +599,7 @@ class Alert(models.Model):
                          Q(contact__group_id=user.default_group.group_id))
 
     @classmethod
-    def import_data(cls, data, mapping, format, user):
+    def import_data(cls, data, mapping, format, user, progress=None):
         logger = logging.getLogger('import.alert')
         logger.debug('Début de l’import d’alertes')
         company_cache = ImportCache(Company, user, logger)
@@ -239,7 +607,10 @@ class Alert(models.Model):
         imported_objects = {}
         errors = 0
         data = combine_rows(data, mapping)
-        for row in data:
+        company_field = mapping.get('company', 'company')
+        data = preloaded(data, [(company_cache,
+                                 lambda row: [row.get(company_field)])])
+        for i, row in enumerate(data, 1):
             try:
                 with transaction.atomic():
                     row = apply_mapping(row, mapping)
@@ -276,6 +647,12 @@ class Alert(models.Model):
                 logger.error('Erreur inattendue ({}) : {}'
                              .format(e.__class__.__name__, e))
                 errors += 1
+            if progress is not None and i % IMPORT_BATCH_SIZE == 0:
+                progress(len(imported_objects), 0, errors)
+        if progress is not None:
+            progress(len(imported_objects), 0, errors)
+        company_cache.log_stats()
+        contact_cache.log_stats()
         logger.debug('Fin de l’import d’alertes ({} créés, '
                      '{} erreurs)'
                      .format(len(imported_objects),
@@ -283,43 +660,11 @@ class Alert(models.Model):
         return (list(imported_objects.values()), [], errors)
 
     @classmethod
-    def export_data(self, qs):
-        export = []
-        fields = {'title': None,
-                  'firstname': 'contact__firstname',
-                  'lastname': 'contact__lastname',
-                  'company': 'contact__company__name',
-                  'date': None,
-                  'priority': None,
-                  'done': None,
-                  'comments': None,
-                  }
-        logger = logging.getLogger('export.alert')
-        for obj in qs:
-            logger.debug('Beginning export of alert {}'.format(obj))
-            row = OrderedDict()
-            for key, mapping in fields.items():
-                if mapping is None:
-                    row[key] = getattr(obj, key)
-                else:
-                    remaining_fields = mapping.split('__')
-                    value = obj
-                    while len(remaining_fields) >= 1:
-                        try:
-                            value = getattr(value, remaining_fields.pop(0))
-                        except AttributeError:
-                            value = ''
-                    row[key] = value
-                if isinstance(row[key], bool):
-                    row[key] = int(row[key])
-                elif hasattr(row[key], 'isoformat'):
-                    row[key] = row[key].isoformat()
-            export.append(row)
-
-        return export
+    def export_data(cls, qs):
+        return QuerysetExport(qs)
 
     def is_owned(self, user, perm=None):
-        return self.user == user or self.author == user
+        return user.pk in (self.user_id, self.author_id)
 
     def is_near(self):
         now = timezone.now()
@@ -337,6 +682,15 @@ class Alert(models.Model):
         ordering = ['-date']
         permissions = (('view_alert', 'Can view an alert'), )
         select_related = ('user', 'contact', 'contact__company', 'author', )
+        export_fields = (('title', 'title'),
+                         ('firstname', 'contact__firstname'),
+                         ('lastname', 'contact__lastname'),
+                         ('company', 'contact__company__name'),
+                         ('date', 'date'),
+                         ('priority', 'priority'),
+                         ('done', 'done'),
+                         ('comments', 'comments'),
+                         )
 
 
 class ContactType(models.Model):
@@ -354,7 +708,7 @@ class ContactType(models.Model):
         return self.name
 
     def is_owned(self, user, perm=None):
-        return self.group.id == user.default_group.group_id
+        return self.group_id == user.default_group.group_id
 
     @classmethod
     def get_queryset(cls, user, qs=None):
@@ -389,6 +743,8 @@ class Company(models.Model):
     active = models.BooleanField('actif', default=True, db_index=True)
     author = models.ForeignKey(User, verbose_name='créateur',
                                related_name='added_companies')
+    contacts_count = models.PositiveIntegerField('nombre de contacts',
+                                                 default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -440,13 +796,18 @@ class Company(models.Model):
     def get_absolute_url(self):
         return reverse('contacts:company-detail', kwargs={'slug': self.slug})
 
+    def make_slug(self):
+        return slugify('{} {}'.format(self.group.pk, self.name))
+
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify('{} {}'.format(self.group.pk, self.name))
+            self.slug = self.make_slug()
+        if not self._state.adding:
+            kwargs.setdefault('update_fields', counted_update_fields(self))
         return super().save(*args, **kwargs)
 
     @classmethod
-    def import_data(cls, data, mapping, properties, user):
+    def import_data(cls, data, mapping, properties, user, progress=None):
         logger = logging.getLogger('import.company')
         logger.debug('Début de l’import de sociétés')
         type_cache = ImportCache(ContactType, user, logger)
@@ -454,7 +815,16 @@ class Company(models.Model):
         imported_objects = {}
         updated_objects = {}
         errors = 0
-        for row in data:
+        type_field = mapping.get('type', 'type')
+        data = preloaded(data, [
+            (type_cache, lambda row: [row.get(type_field)]),
+            (prop_cache, lambda row: [{'type': 'company', 'name': prop}
+                                      for prop in property_names(
+                                          row, mapping,
+                                          cls._meta.import_fields,
+                                          properties)]),
+        ])
+        for i, row in enumerate(data, 1):
             try:
                 with transaction.atomic():
                     row = apply_mapping(row, mapping)
@@ -466,12 +836,10 @@ class Company(models.Model):
                         args['properties'] = {}
                         args['author'] = user
                         args['group'] = user.default_group.group
-                        for prop, prop_value in row.items():
-                            if prop is not None and\
-                                    (properties is None or prop in properties):
-                                prop_cache.get({'type': 'company',
-                                                'name': prop})
-                                args['properties'][prop] = prop_value
+                        for prop in property_names(row, {}, (),
+                                                   properties):
+                            prop_cache.get({'type': 'company', 'name': prop})
+                            args['properties'][prop] = row[prop]
                         # do we have to create an object, or is there an
                         # existing one to update?
                         try:
@@ -499,6 +867,12 @@ class Company(models.Model):
                 logger.error('Erreur inattendue ({}) : {}'
                              .format(e.__class__.__name__, e))
                 errors += 1
+            if progress is not None and i % IMPORT_BATCH_SIZE == 0:
+                progress(len(imported_objects), len(updated_objects), errors)
+        if progress is not None:
+            progress(len(imported_objects), len(updated_objects), errors)
+        type_cache.log_stats()
+        prop_cache.log_stats()
         logger.debug('Fin de l’import de sociétés ({} créées, {} modifiées, '
                      '{} erreurs)'
                      .format(len(imported_objects), len(updated_objects),
@@ -507,37 +881,8 @@ class Company(models.Model):
                 list(updated_objects.values()), errors)
 
     @classmethod
-    def export_data(self, qs):
-        export = []
-        fields = {'name': None,
-                  'type': 'type__name',
-                  'comments': None,
-                  }
-        logger = logging.getLogger('export.company')
-        for obj in qs:
-            logger.debug('Beginning export of company {}'.format(obj))
-            row = OrderedDict()
-            for key, mapping in fields.items():
-                if mapping is None:
-                    row[key] = getattr(obj, key)
-                else:
-                    remaining_fields = mapping.split('__')
-                    value = obj
-                    while len(remaining_fields) >= 1:
-                        try:
-                            value = getattr(value, remaining_fields.pop(0))
-                        except AttributeError:
-                            value = ''
-                    row[key] = value
-                if isinstance(row[key], bool):
-                    row[key] = int(row[key])
-                elif hasattr(row[key], 'isoformat'):
-                    row[key] = row[key].isoformat()
-            # properties fetch
-            row.update(obj.properties)
-            export.append(row)
-
-        return export
+    def export_data(cls, qs):
+        return QuerysetExport(qs)
 
     @classmethod
     def get_queryset(cls, user, qs=None):
@@ -546,7 +891,7 @@ class Company(models.Model):
         return qs.filter(group_id=user.default_group.group_id)
 
     def is_owned(self, user, perm=None):
-        return self.group.id == user.default_group.group_id
+        return self.group_id == user.default_group.group_id
 
     class Meta:
         verbose_name = 'société'
@@ -559,7 +904,13 @@ class Company(models.Model):
         ordering = ['name']
         unique_together = (('slug', 'group'), )
         permissions = (('view_company', 'Can view a company'), )
+        counter_fields = {'contacts': 'contacts_count'}
         select_related = ('type', 'author', )
+        import_fields = ('name', 'type', 'comments')
+        export_fields = (('name', 'name'),
+                         ('type', 'type__name'),
+                         ('comments', 'comments'),
+                         )
 
 
 class Contact(models.Model):
@@ -579,6 +930,14 @@ class Contact(models.Model):
     active = models.BooleanField('actif', default=True, db_index=True)
     author = models.ForeignKey(User, verbose_name='créateur',
                                related_name='added_contacts')
+    meetings_count = models.PositiveIntegerField('nombre d’échanges',
+                                                 default=0, editable=False)
+    open_alerts_count = models.PositiveIntegerField('nombre d’alertes '
+                                                    'en cours', default=0,
+                                                    editable=False)
+    # maintained by the database, for typeahead searches
+    search_name = models.TextField('nom normalisé', default='',
+                                   editable=False)
 
     def __str__(self):
         return '{} {}'.format(self.firstname, self.lastname)
@@ -624,72 +983,98 @@ class Contact(models.Model):
     def get_absolute_url(self):
         return reverse('contacts:contact-detail', kwargs={'slug': self.slug})
 
+    def make_slug(self):
+        company = '{} '.format(self.company) if self.company else ''
+        return slugify('{}{} {}'.format(company, self.firstname,
+                                        self.lastname))
+
     def save(self, *args, **kwargs):
         if not self.slug:
-            company = '{} '.format(self.company) if self.company else ''
-            self.slug = slugify('{}{} {}'.format(company, self.firstname,
-                                                 self.lastname))
+            self.slug = self.make_slug()
+        if not self._state.adding:
+            kwargs.setdefault('update_fields', counted_update_fields(self))
         return super().save(*args, **kwargs)
 
     @classmethod
-    def import_data(cls, data, mapping, properties, user):
+    def import_data(cls, data, mapping, properties, user,
+                    batch_size=IMPORT_BATCH_SIZE, progress=None):
+        """ Imports contacts from an iterable of rows.
+        With a `batch_size`, rows are written by chunks: existing contacts are
+        fetched with one query per chunk, and new ones are inserted with
+        `bulk_create`. A chunk which fails is replayed row by row, so a bad
+        row only costs itself. A false `batch_size` imports row by row.
+        """
         logger = logging.getLogger('import.contact')
         logger.debug('Début de l’import de contacts')
-        company_cache = ImportCache(Company, user, logger)
-        type_cache = ImportCache(ContactType, user, logger)
-        prop_cache = ImportCache(Properties, user, logger)
+        caches = cls._import_caches(user, logger)
         imported_objects = {}
         updated_objects = {}
         errors = 0
-        for row in data:
-            try:
-                with transaction.atomic():
-                    row = apply_mapping(row, mapping)
-                    if row['firstname'] != '' or row['lastname'] != '':
-                        args = {}
-                        args['company'] = company_cache.get(row.pop('company'))
-                        args['type'] = type_cache.get(row.pop('type'))
-                        args['firstname'] = row.pop('firstname')
-                        args['lastname'] = row.pop('lastname')
-                        args['comments'] = row.pop('comments')
-                        args['properties'] = {}
-                        args['author'] = user
-                        args['group'] = user.default_group.group
-                        for prop, prop_value in row.items():
-                            if prop is not None and\
-                                    (properties is None or prop in properties):
-                                prop_cache.get({'type': 'contact',
-                                                'name': prop})
-                                args['properties'][prop] = prop_value
-                        # do we have to create an object, or is there an
-                        # existing one to update?
-                        try:
-                            contact = cls.get_queryset(user).get(
-                                company=args['company'],
-                                firstname=args['firstname'],
-                                lastname=args['lastname'])
-                            contact.properties.update(args['properties'])
-                            contact.type = args['type']
-                            contact.comments = args['comments']
-                            contact.save()
-                            updated_objects[contact.pk] = contact
-                            logger.info('Modification de contact : {}'
-                                        .format(contact))
-                        except cls.DoesNotExist:
-                            contact = cls.objects.create(**args)
-                            logger.info('Création de contact : {}'
-                                        .format(contact))
-                            imported_objects[contact.pk] = contact
-                        else:
-                            logger.info('Contact sans nom : on passe')
-            except DataImportError as e:
-                logger.error('Erreur lors de l’import du contact : {}'
-                             .format(e))
-                errors += 1
-            except Exception as e:
-                logger.error('Erreur inattendue ({}) : {}'
-                             .format(e.__class__.__name__, e))
-                errors += 1
+        for chunk in chunks(data, batch_size or 1):
+            mapped_rows = []
+            for row in chunk:
+                try:
+                    mapped_rows.append(apply_mapping(row, mapping))
+                except DataImportError as e:
+                    logger.error('Erreur lors de l’import du contact : {}'
+                                 .format(e))
+                    errors += 1
+            if batch_size:
+                cls._preload_caches(caches, mapped_rows, properties)
+            rows = []
+            for row in mapped_rows:
+                try:
+                    args = cls._import_args(row, properties, user, caches)
+                    if args is None:
+                        logger.info('Contact sans nom : on passe')
+                    else:
+                        rows.append(args)
+                except DataImportError as e:
+                    logger.error('Erreur lors de l’import du contact : {}'
+                                 .format(e))
+                    errors += 1
+                except Exception as e:
+                    logger.error('Erreur inattendue ({}) : {}'
+                                 .format(e.__class__.__name__, e))
+                    errors += 1
+            if batch_size and len(rows) > 1:
+                try:
+                    inserted, updated, ambiguous = cls._import_chunk(rows,
+                                                                     user)
+                    for contact in inserted:
+                        imported_objects[contact.pk] = contact
+                    for contact in updated:
+                        updated_objects[contact.pk] = contact
+                    logger.info('Lot de {} contacts : {} créés, {} modifiés'
+                                .format(len(rows), len(inserted),
+                                        len(updated)))
+                    # the rows matching several contacts fail row by row
+                    rows = ambiguous
+                except Exception as e:
+                    logger.warning('Échec du lot de {} contacts ({} : {}), '
+                                   'import ligne par ligne'
+                                   .format(len(rows), e.__class__.__name__,
+                                           e))
+            for args in rows:
+                try:
+                    with transaction.atomic():
+                        contact, created = cls._import_row(args, user)
+                    if created:
+                        imported_objects[contact.pk] = contact
+                        logger.info('Création de contact : {}'
+                                    .format(contact))
+                    else:
+                        updated_objects[contact.pk] = contact
+                        logger.info('Modification de contact : {}'
+                                    .format(contact))
+                except Exception as e:
+                    logger.error('Erreur inattendue ({}) : {}'
+                                 .format(e.__class__.__name__, e))
+                    errors += 1
+            if progress is not None:
+                progress(len(imported_objects), len(updated_objects), errors)
+        for cache in caches.values():
+            cache.log_stats()
         logger.debug('Fin de l’import de contacts ({} créés, {} modifiés, '
                      '{} erreurs)'
                      .format(len(imported_objects), len(updated_objects),
@@ -698,39 +1083,133 @@ class Contact(models.Model):
                 list(updated_objects.values()), errors)
 
     @classmethod
-    def export_data(self, qs):
-        export = []
-        fields = {'firstname': None,
-                  'lastname': None,
-                  'company': 'company__name',
-                  'type': 'type__name',
-                  'comments': None,
-                  }
-        logger = logging.getLogger('export.contact')
-        for obj in qs:
-            logger.debug('Beginning export of contact {}'.format(obj))
-            row = OrderedDict()
-            for key, mapping in fields.items():
-                if mapping is None:
-                    row[key] = getattr(obj, key)
+    def _import_caches(cls, user, logger):
+        return {'company': ImportCache(Company, user, logger),
+                'type': ImportCache(ContactType, user, logger),
+                'properties': ImportCache(Properties, user, logger),
+                }
+
+    @classmethod
+    def _preload_caches(cls, caches, rows, properties):
+        """ Fills the import caches for a chunk of mapped rows. """
+        caches['company'].preload(row.get('company') for row in rows)
+        caches['type'].preload(row.get('type') for row in rows)
+        caches['properties'].preload(
+            {'type': 'contact', 'name': prop}
+            for row in rows
+            for prop in property_names(row, {}, cls._meta.import_fields,
+                                       properties))
+
+    @classmethod
+    def _import_args(cls, row, properties, user, caches):
+        """ Turns a mapped CSV row into Contact attributes, or None for a row
+        without name.
+        """
+        if row['firstname'] == '' and row['lastname'] == '':
+            return None
+        args = {}
+        args['company'] = caches['company'].get(row.pop('company'))
+        args['type'] = caches['type'].get(row.pop('type'))
+        args['firstname'] = row.pop('firstname')
+        args['lastname'] = row.pop('lastname')
+        args['comments'] = row.pop('comments')
+        args['properties'] = {}
+        args['author'] = user
+        args['group'] = user.default_group.group
+        for prop in property_names(row, {}, (), properties):
+            caches['properties'].get({'type': 'contact', 'name': prop})
+            args['properties'][prop] = row[prop]
+        return args
+
+    @classmethod
+    def _import_row(cls, args, user):
+        """ Creates or updates a single contact.
+        Returns the contact and whether it has been created.
+        """
+        # do we have to create an object, or is there an existing one to
+        # update?
+        try:
+            contact = cls.get_queryset(user).get(
+                company=args['company'],
+                firstname=args['firstname'],
+                lastname=args['lastname'])
+            contact.properties.update(args['properties'])
+            contact.type = args['type']
+            contact.comments = args['comments']
+            contact.save()
+            return contact, False
+        except cls.DoesNotExist:
+            return cls.objects.create(**args), True
+
+    @classmethod
+    def _import_chunk(cls, rows, user):
+        """ Creates or updates the contacts of a chunk of rows, with one query
+        to fetch the existing contacts, one `bulk_create` and one UPDATE, in a
+        savepoint.
+        Returns the lists of created and updated contacts, and the rows left
+        to the row by row import because they match several existing
+        contacts. As with the row by row import, a row matching a contact
+        created by an earlier row of the chunk counts as an update.
+        """
+        existing = {}
+        ambiguous_keys = set()
+        for contact in cls.get_queryset(user).filter(
+                firstname__in={args['firstname'] for args in rows},
+                lastname__in={args['lastname'] for args in rows}):
+            key = (contact.company_id, contact.firstname, contact.lastname)
+            if key in existing:
+                ambiguous_keys.add(key)
+            existing[key] = contact
+
+        to_create = OrderedDict()
+        to_update = OrderedDict()
+        updated_created = OrderedDict()
+        ambiguous = []
+        for args in rows:
+            company = args['company']
+            key = (company.pk if company else None, args['firstname'],
+                   args['lastname'])
+            if key in ambiguous_keys:
+                ambiguous.append(args)
+                continue
+            contact = existing.get(key, to_create.get(key))
+            if contact is None:
+                # the properties are updated by the later rows of the chunk,
+                # while the row may still be replayed if the chunk fails
+                contact = cls(**dict(args,
+                                     properties=dict(args['properties'])))
+                contact.slug = contact.make_slug()
+                to_create[key] = contact
+            else:
+                contact.properties.update(args['properties'])
+                contact.type = args['type']
+                contact.comments = args['comments']
+                if key in existing:
+                    to_update[key] = contact
                 else:
-                    remaining_fields = mapping.split('__')
-                    value = obj
-                    while len(remaining_fields) >= 1:
-                        try:
-                            value = getattr(value, remaining_fields.pop(0))
-                        except AttributeError:
-                            value = ''
-                    row[key] = value
-                if isinstance(row[key], bool):
-                    row[key] = int(row[key])
-                elif hasattr(row[key], 'isoformat'):
-                    row[key] = row[key].isoformat()
-            # properties fetch
-            row.update(obj.properties)
-            export.append(row)
-
-        return export
+                    updated_created[key] = contact
+
+        created = list(to_create.values())
+        updated = list(to_update.values())
+        now = timezone.now()
+        for contact in updated:
+            contact.update_date = now
+        with transaction.atomic():
+            cls.objects.bulk_create(created)
+            bulk_update(cls, updated,
+                        ('type', 'comments', 'properties', 'update_date'))
+            # bulk_create does not set the primary keys: fetch them back with
+            # the slugs, which are unique in the group
+            pks = dict(cls.get_queryset(user)
+                       .filter(slug__in=[c.slug for c in created])
+                       .values_list('slug', 'pk'))
+            for contact in created:
+                contact.pk = pks[contact.slug]
+        return created, updated + list(updated_created.values()), ambiguous
+
+    @classmethod
+    def export_data(cls, qs):
+        return QuerysetExport(qs)
 
     @classmethod
     def get_queryset(cls, user, qs=None):
@@ -739,7 +1218,7 @@ class Contact(models.Model):
         return qs.filter(group_id=user.default_group.group_id)
 
     def is_owned(self, user, perm=None):
-        return self.group.id == user.default_group.group_id
+        return self.group_id == user.default_group.group_id
 
     class Meta:
         verbose_name = 'contact'
@@ -752,7 +1231,17 @@ class Contact(models.Model):
         ordering = ['firstname', 'lastname']
         unique_together = (('slug', 'group'), )
         permissions = (('view_contact', 'Can view a contact'), )
+        counter_fields = {'meetings': 'meetings_count',
+                          'open_alerts': 'open_alerts_count'}
         select_related = ('company', 'type', 'author', )
+        import_fields = ('company', 'type', 'firstname', 'lastname',
+                         'comments')
+        export_fields = (('firstname', 'firstname'),
+                         ('lastname', 'lastname'),
+                         ('company', 'company__name'),
+                         ('type', 'type__name'),
+                         ('comments', 'comments'),
+                         )
 
 
 class MeetingType(models.Model):
@@ -770,7 +1259,7 @@ class MeetingType(models.Model):
         return self.name
 
     def is_owned(self, user, perm=None):
-        return self.group.id == user.default_group.group_id
+        return self.group_id == user.default_group.group_id
 
     @classmethod
     def get_queryset(cls, user, qs=None):
@@ -821,20 +1310,56 @@ class Meeting(models.Model):
             qs = cls.objects
         return qs.filter(contact__group_id=user.default_group.group_id)
 
+    @classmethod
+    def get_owned_pks(cls, user, pks):
+        """
+        Returns the set of the given primary keys of the meetings owned by
+        the user, in a single query.
+        """
+        return set(cls.get_queryset(user).filter(pk__in=pks)
+                   .values_list('pk', flat=True))
+
     def is_owned(self, user, perm=None):
-        return self.contact.group.id == user.default_group.group_id
+        if self.contact_id is None:
+            return False
+        contact_cache = self._meta.get_field('contact').get_cache_name()
+        if hasattr(self, contact_cache):
+            return self.contact.group_id == user.default_group.group_id
+        return self.pk in self.get_owned_pks(user, [self.pk])
 
     @classmethod
-    def import_data(cls, data, mapping, format, user):
+    def _import_caches(cls, user, logger):
+        return {'company': ImportCache(Company, user, logger),
+                'contact': ImportCache(Contact, user, logger),
+                'type': ImportCache(MeetingType, user, logger),
+                }
+
+    @classmethod
+    def _preload_caches(cls, caches, rows, format):
+        """ Fills the import caches for a chunk of mapped rows. Contacts are
+        left out: they are looked up by company.
+        """
+        caches['company'].preload(row.get('company') for row in rows)
+        caches['type'].preload(row.get('type') for row in rows)
+
+    @classmethod
+    def import_data(cls, data, mapping, format, user, progress=None):
         logger = logging.getLogger('import.meeting')
         logger.debug('Début de l’import d’échanges')
-        company_cache = ImportCache(Company, user, logger)
-        contact_cache = ImportCache(Contact, user, logger)
-        type_cache = ImportCache(MeetingType, user, logger)
+        caches = cls._import_caches(user, logger)
+        company_cache = caches['company']
+        contact_cache = caches['contact']
+        type_cache = caches['type']
         imported_objects = {}
         errors = 0
         data = combine_rows(data, mapping)
-        for row in data:
+        company_field = mapping.get('company', 'company')
+        type_field = mapping.get('type', 'type')
+        data = preloaded(data, [
+            (company_cache, lambda row: [row.get(company_field)]),
+            (type_cache, lambda row: [row.get(type_field)]),
+        ])
+        for i, row in enumerate(data, 1):
             try:
                 with transaction.atomic():
                     row = apply_mapping(row, mapping)
@@ -868,6 +1393,13 @@ class Meeting(models.Model):
                 logger.error('Erreur inattendue ({}) : {}'
                              .format(e.__class__.__name__, e))
                 errors += 1
+            if progress is not None and i % IMPORT_BATCH_SIZE == 0:
+                progress(len(imported_objects), 0, errors)
+        if progress is not None:
+            progress(len(imported_objects), 0, errors)
+        company_cache.log_stats()
+        contact_cache.log_stats()
+        type_cache.log_stats()
         logger.debug('Fin de l’import d’échanges ({} créés, '
                      '{} erreurs)'
                      .format(len(imported_objects),
@@ -875,38 +1407,8 @@ class Meeting(models.Model):
         return (list(imported_objects.values()), [], errors)
 
     @classmethod
-    def export_data(self, qs):
-        export = []
-        fields = {'firstname': 'contact__firstname',
-                  'lastname': 'contact__lastname',
-                  'company': 'contact__company__name',
-                  'type': 'type__name',
-                  'date': None,
-                  'comments': None,
-                  }
-        logger = logging.getLogger('export.meeting')
-        for obj in qs:
-            logger.debug('Beginning export of meeting {}'.format(obj))
-            row = OrderedDict()
-            for key, mapping in fields.items():
-                if mapping is None:
-                    row[key] = getattr(obj, key)
-                else:
-                    remaining_fields = mapping.split('__')
-                    value = obj
-                    while len(remaining_fields) >= 1:
-                        try:
-                            value = getattr(value, remaining_fields.pop(0))
-                        except AttributeError:
-                            value = ''
-                    row[key] = value
-                if isinstance(row[key], bool):
-                    row[key] = int(row[key])
-                elif hasattr(row[key], 'isoformat'):
-                    row[key] = row[key].isoformat()
-            export.append(row)
-
-        return export
+    def export_data(cls, qs):
+        return QuerysetExport(qs)
 
     class Meta:
         verbose_name = 'échange'
@@ -920,6 +1422,13 @@ class Meeting(models.Model):
         order_mapping = {'company': 'contact__company__name'}
         permissions = (('view_meeting', 'Can view a meeting'), )
         select_related = ('contact', 'contact__company', 'type', 'author', )
+        export_fields = (('firstname', 'contact__firstname'),
+                         ('lastname', 'contact__lastname'),
+                         ('company', 'contact__company__name'),
+                         ('type', 'type__name'),
+                         ('date', 'date'),
+                         ('comments', 'comments'),
+                         )
 
 
 class SavedSearch(models.Model):
@@ -935,6 +1444,15 @@ class SavedSearch(models.Model):
                                related_name='saved_searches')
     results_count = models.PositiveIntegerField('nombre de résultats',
                                                 default=0)
+    count_stale = models.BooleanField('nombre de résultats à recalculer',
+                                      default=True, db_index=True)
+    count_date = models.DateTimeField('date du calcul du nombre de résultats',
+                                      null=True, blank=True)
+    materialized = models.BooleanField('résultats enregistrés',
+                                       default=False)
+    materialized_date = models.DateTimeField('date d’enregistrement des '
+                                             'résultats', null=True,
+                                             blank=True)
     creation_date = models.DateTimeField('date de création', auto_now_add=True)
     update_date = models.DateTimeField('date de mise à jour', auto_now=True)
 
@@ -955,21 +1473,174 @@ class SavedSearch(models.Model):
         return qs.filter(group_id=user.default_group.group_id)
 
     def is_owned(self, user, perm=None):
-        return self.group.id == user.default_group.group_id
+        return self.group_id == user.default_group.group_id
+
+    @classmethod
+    def get_menu(cls, group_id):
+        """
+        Returns the searches of a group displayed in the menu, as a dict of
+        lists of dicts (slug, name and results count) by type.
+        The menu is fetched in a single query, and cached until one of the
+        searches of the group is written (see invalidate_menu()). The
+        invalidation only reaches the processes sharing the cache, the others
+        see the changes after SEARCH_MENU_CACHE_TIMEOUT seconds at most.
+        """
+        key = versioned_key('searches-menu-{}'.format(group_id))
+        menu = cache.get(key)
+        if menu is None:
+            menu = {type: [] for type, name in SEARCH_CHOICES}
+            for search in cls.objects.filter(group_id=group_id,
+                                             display_in_menu=True)\
+                    .order_by('type', 'name')\
+                    .values('type', 'slug', 'name', 'results_count'):
+                menu[search.pop('type')].append(search)
+            cache.set(key, menu, SEARCH_MENU_CACHE_TIMEOUT)
+        return menu
 
-    def get_search_queryset(self, user):
+    @classmethod
+    def invalidate_menu(cls, group_id):
+        bump_version('searches-menu-{}'.format(group_id))
+
+    def get_search_queryset(self, user, materialized=True):
+        """
+        Returns the items matching the search. Materialized searches are read
+        from their stored results, unless `materialized` is False.
+        """
         from . import forms
         model = self.get_search_model()
         if hasattr(model, 'get_queryset'):
             qs = model.get_queryset(user)
         else:
             qs = model.objects.all()
+        if materialized and self.materialized \
+                and self.materialized_date is not None:
+            return qs.filter(pk__in=self.results.values('object_id'))
         form_class = getattr(forms, '{}SearchForm'.format(self.type))
         form = form_class(data=self.data)
-        qs = form.search(qs)
-        self.results_count = qs.count()
-        self.save()
-        return qs
+        return form.search(qs)
+
+    def materialize(self, full=False):
+        """
+        Stores the primary keys of the items matching the search. Unless
+        `full` is set, only the items updated since the last refresh are
+        evaluated again: changes to related items (such as the company of
+        a contact) are only taken into account by full refreshes.
+        """
+        user = self.get_search_user()
+        model = self.get_search_model()
+        start = timezone.now()
+        items = model.get_queryset(user)
+        matching = self.get_search_queryset(user, materialized=False)
+        full = full or self.materialized_date is None
+        if not full:
+            since = self.materialized_date
+            items = items.filter(update_date__gte=since)
+            matching = matching.filter(update_date__gte=since)
+        table = SavedSearchResult._meta.db_table
+        with transaction.atomic(), connections['default'].cursor() as cursor:
+            if full:
+                cursor.execute('DELETE FROM {} WHERE search_id = %s'
+                               .format(table), [self.pk])
+            else:
+                sql, params = items.values('pk').query.sql_with_params()
+                cursor.execute('DELETE FROM {} WHERE search_id = %s AND '
+                               'object_id IN ({})'.format(table, sql),
+                               [self.pk] + list(params))
+            sql, params = matching.values('pk').query.sql_with_params()
+            cursor.execute('INSERT INTO {table} (search_id, object_id) '
+                           'SELECT DISTINCT %s, matching.id FROM ({sql}) '
+                           'AS matching WHERE NOT EXISTS (SELECT 1 FROM '
+                           '{table} WHERE search_id = %s AND '
+                           'object_id = matching.id)'
+                           .format(table=table, sql=sql),
+                           [self.pk] + list(params) + [self.pk])
+            SavedSearch.objects.filter(pk=self.pk).update(
+                materialized_date=start)
+        self.materialized_date = start
+
+    @classmethod
+    def refresh_materialized(cls, full=False):
+        """
+        Refreshes the stored results of all the materialized searches.
+        """
+        searches = cls.objects.filter(materialized=True)\
+            .select_related('author', 'group')
+        for search in searches:
+            search.materialize(full)
+        return len(searches)
+
+    def get_search_user(self):
+        """
+        Returns the author, working in the group of the search.
+        """
+        user = self.author
+        user.default_group = DefaultGroup(user=user, group=self.group)
+        return user
+
+    @classmethod
+    def mark_stale(cls, type, group_id=None, contact_id=None, user_ids=()):
+        """
+        Flags the results counts of the searches depending on a type of items
+        as stale (see SEARCH_DEPENDENCIES), for the given group, the group of
+        the given contact or else the groups of the given users.
+        """
+        qs = cls.objects.filter(type__in=SEARCH_DEPENDENCIES[type],
+                                count_stale=False)
+        if group_id is not None:
+            qs = qs.filter(group_id=group_id)
+        elif contact_id is not None:
+            qs = qs.filter(group__contacts=contact_id)
+        else:
+            qs = qs.filter(group__user__in=user_ids)
+        qs.update(count_stale=True)
+
+    def count_results(self):
+        """
+        Counts the results of the search, as its author, stores the count and
+        returns it. The menu of the group is invalidated if it changed.
+        Materialized searches are counted on the items, not on their stored
+        results, which may not have been refreshed yet.
+        """
+        count = self.get_search_queryset(self.get_search_user(),
+                                         materialized=False).count()
+        SavedSearch.objects.filter(pk=self.pk).update(
+            results_count=count, count_date=timezone.now())
+        if count != self.results_count and self.display_in_menu:
+            self.invalidate_menu(self.group_id)
+        self.results_count = count
+        return count
+
+    @classmethod
+    def refresh_counts(cls, batch_size=SEARCH_COUNT_BATCH_SIZE):
+        """
+        Counts the results of the searches flagged as stale, by batches of
+        `batch_size` searches, and returns the number of counted searches.
+        The flag is cleared before counting, so that writes happening
+        meanwhile flag the search again, and set back on the searches which
+        can't be counted.
+        """
+        logger = logging.getLogger('search.count')
+        counted = []
+        while True:
+            pks = list(cls.objects.filter(count_stale=True)
+                       .exclude(pk__in=counted)
+                       .values_list('pk', flat=True)[:batch_size])
+            if len(pks) == 0:
+                return len(counted)
+            cls.objects.filter(pk__in=pks).update(count_stale=False)
+            for search in cls.objects.filter(pk__in=pks)\
+                    .select_related('author', 'group'):
+                try:
+                    count = search.count_results()
+                except Exception as e:
+                    logger.error('Échec du calcul de la recherche {} ({} : '
+                                 '{})'.format(search.pk,
+                                             e.__class__.__name__, e))
+                    cls.objects.filter(pk=search.pk).update(count_stale=True)
+                    continue
+                logger.debug('Recherche {} : {} résultats'
+                             .format(search.pk, count))
+            counted += pks
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -987,3 +1658,264 @@ class SavedSearch(models.Model):
         ordering = ['name']
         unique_together = (('slug', 'group'), )
         permissions = (('view_savedsearch', 'Can view a saved search'), )
+
+
+def import_shard(model_name, rows, mapping, options, user_pk, group_pk):
+    """ Imports a shard of rows, in a worker process of sharded_import.
+    Returns the primary keys of the inserted and updated objects, and the
+    number of errors.
+    """
+    model = getattr(sys.modules[__name__], model_name)
+    user = User.objects.get(pk=user_pk)
+    user.default_group = DefaultGroup(user=user,
+                                      group=Group.objects.get(pk=group_pk))
+    inserted, updated, errors = model.import_data(rows, mapping, options,
+                                                  user)
+    return ([obj.pk for obj in inserted], [obj.pk for obj in updated],
+            errors)
+
+
+def sharded_import(model, data, mapping, options, user, processes,
+                   progress=None, batch_size=IMPORT_BATCH_SIZE):
+    """ Imports contacts or meetings with a pool of processes.
+    The objects the rows refer to (companies, types and properties) are
+    resolved first, in the main process, so that the processes never compete
+    to create them. Then the rows are dispatched to shards by company: the
+    rows of a company are always imported in order, by one process at a
+    time, so that the processes never compete for the same contacts.
+    Returns the merged (inserted primary keys, updated primary keys, errors)
+    results of the shards.
+    """
+    logger = logging.getLogger('import.{}'.format(model._meta.model_name))
+    logger.debug('Import en {} processus'.format(processes))
+    caches = model._import_caches(user, logger)
+    company_field = mapping.get('company', 'company')
+    if model is Meeting:
+        # FK-rows have to be combined before the rows are split up
+        data = combine_rows(data, mapping)
+    shards = [[] for i in range(processes)]
+    running = [None] * processes
+    results = ([], [], 0)
+
+    def collect(shard):
+        nonlocal results
+        if running[shard] is not None:
+            inserted, updated, errors = running[shard].get()
+            results = (results[0] + inserted, results[1] + updated,
+                       results[2] + errors)
+            running[shard] = None
+            if progress is not None:
+                progress(len(results[0]), len(results[1]), results[2])
+
+    def submit(shard):
+        collect(shard)
+        running[shard] = pool.apply_async(
+            import_shard, (model.__name__, shards[shard], mapping, options,
+                           user.pk, user.default_group.group_id))
+        shards[shard] = []
+
+    # the processes are forked once, here, and must not share the
+    # connections of this one
+    for connection in connections.all():
+        connection.close()
+    with multiprocessing.Pool(processes) as pool:
+        for chunk in chunks(data, batch_size):
+            mapped_rows = []
+            for row in chunk:
+                try:
+                    mapped_rows.append(apply_mapping(row, mapping))
+                except DataImportError:
+                    # reported by the shard importing the row
+                    pass
+            model._preload_caches(caches, mapped_rows, options)
+            for row in chunk:
+                shard = hash(row.get(company_field) or '') % processes
+                shards[shard].append(row)
+                if len(shards[shard]) >= batch_size:
+                    submit(shard)
+        for shard in range(processes):
+            if len(shards[shard]) > 0:
+                submit(shard)
+        for shard in range(processes):
+            collect(shard)
+    for cache in caches.values():
+        cache.log_stats()
+    return results
+
+
+class SavedSearchResult(models.Model):
+    search = models.ForeignKey(SavedSearch, verbose_name='recherche',
+                               related_name='results')
+    object_id = models.PositiveIntegerField('identifiant')
+
+    class Meta:
+        verbose_name = 'résultat de recherche'
+        unique_together = (('search', 'object_id'), )
+
+
+class ImportJob(models.Model):
+    group = models.ForeignKey(Group, verbose_name='groupe',
+                              related_name='import_jobs')
+    author = models.ForeignKey(User, verbose_name='créateur',
+                               related_name='import_jobs')
+    type = models.CharField('type', max_length=32, choices=SEARCH_CHOICES)
+    file = models.FileField('fichier', upload_to='imports/%Y/%m/')
+    encoding = models.CharField('encodage', max_length=32)
+    mapping = fields.HStoreField('correspondance des champs', default={})
+    properties = fields.ArrayField(models.CharField(max_length=100),
+                                   verbose_name='propriétés', null=True,
+                                   blank=True)
+    date_format = models.CharField('format des dates', max_length=64,
+                                   blank=True)
+    status = models.CharField('statut', max_length=16, choices=JOB_STATUSES,
+                              default=JOB_STATUSES[0][0], db_index=True)
+    rows_count = models.PositiveIntegerField('lignes lues', default=0)
+    inserted_count = models.PositiveIntegerField('créations', default=0)
+    updated_count = models.PositiveIntegerField('modifications', default=0)
+    errors_count = models.PositiveIntegerField('erreurs', default=0)
+    error = models.TextField('erreur', blank=True)
+    start_date = models.DateTimeField('date de début', null=True, blank=True)
+    end_date = models.DateTimeField('date de fin', null=True, blank=True)
+    creation_date = models.DateTimeField('date de création', auto_now_add=True)
+    update_date = models.DateTimeField('date de mise à jour', auto_now=True)
+
+    def __str__(self):
+        return 'import {}{}'.format(self.get_import_model()._meta.words['of'],
+                                    self.get_type_display())
+
+    def get_absolute_url(self):
+        return reverse('contacts:import-job',
+                       kwargs={'type': self.type.lower(), 'pk': self.pk})
+
+    def get_import_model(self):
+        return getattr(sys.modules[__name__], self.type)
+
+    @classmethod
+    def get_queryset(cls, user, qs=None):
+        if qs is None:
+            qs = cls.objects
+        return qs.filter(group_id=user.default_group.group_id)
+
+    def is_owned(self, user, perm=None):
+        return self.group_id == user.default_group.group_id
+
+    def get_throughput(self):
+        """ Rows read per second. """
+        if self.start_date is None:
+            return 0
+        end_date = self.end_date or timezone.now()
+        duration = (end_date - self.start_date).total_seconds()
+        return self.rows_count / duration if duration > 0 else 0
+
+    @classmethod
+    def claim(cls):
+        """ Marks the oldest pending job as running, and returns it.
+        Running jobs without progress for IMPORT_JOB_TIMEOUT seconds, whose
+        worker has most likely crashed, are taken again from the start.
+        The conditional UPDATE makes sure that a job is only taken by one
+        worker.
+        """
+        now = timezone.now()
+        stale = now - timedelta(seconds=IMPORT_JOB_TIMEOUT)
+        for job in cls.objects.filter(Q(status='pending') |
+                                      Q(status='running',
+                                        update_date__lt=stale))\
+                .order_by('creation_date')[:10]:
+            claimed = cls.objects.filter(pk=job.pk, status=job.status,
+                                         update_date=job.update_date)\
+                .update(status='running', start_date=now, update_date=now,
+                        rows_count=0, inserted_count=0, updated_count=0,
+                        errors_count=0)
+            if claimed:
+                job.refresh_from_db()
+                return job
+        return None
+
+    def get_user(self):
+        """ Returns the author, working in the group the job has been
+        submitted in, whatever their current default group.
+        """
+        user = self.author
+        user.default_group = DefaultGroup(user=user, group=self.group)
+        return user
+
+    def progress(self, inserted, updated, errors):
+        """ Stores the counts of the rows imported so far. As the imports
+        read rows ahead, the rows count is only the number of rows read once
+        the job has ended: meanwhile, it doesn't exceed the rows counted.
+        """
+        self.inserted_count = inserted
+        self.updated_count = updated
+        self.errors_count = errors
+        ImportJob.objects.filter(pk=self.pk).update(
+            rows_count=min(self.rows_count, inserted + updated + errors),
+            inserted_count=inserted,
+            updated_count=updated,
+            errors_count=errors,
+            update_date=timezone.now())
+
+    def read_rows(self):
+        """ Streams the rows of the uploaded file. The encoding has been
+        detected on the head of the file only, the rest may not match it.
+        """
+        detection = {'encoding': self.encoding, 'confidence': 1,
+                     'errors': 'surrogateescape'}
+        reader = read_csv(read_chunks(self.file), detection)
+        for row in reencode_data(reader, detection):
+            self.rows_count += 1
+            yield row
+
+    def run(self, shards=1):
+        """ Runs the import. Contacts and meetings imports can be split
+        into `shards` processes.
+        """
+        logger = logging.getLogger('import.job')
+        logger.info('Début de l’{} (job {})'.format(self, self.pk))
+        model = self.get_import_model()
+        options = self.date_format if self.date_format else self.properties
+        try:
+            self.file.open('rb')
+            if shards > 1 and model in (Contact, Meeting):
+                inserted, updated, errors = sharded_import(
+                    model, self.read_rows(), self.mapping, options,
+                    self.get_user(), shards, progress=self.progress)
+            else:
+                inserted, updated, errors = model.import_data(
+                    self.read_rows(), self.mapping, options,
+                    self.get_user(), progress=self.progress)
+            self.inserted_count = len(inserted)
+            self.updated_count = len(updated)
+            self.errors_count = errors
+            self.status = 'done'
+        except Exception as e:
+            logger.error('Échec de l’{} (job {}) : {} : {}'
+                         .format(self, self.pk, e.__class__.__name__, e))
+            self.error = '{} : {}'.format(e.__class__.__name__, e)
+            self.status = 'failed'
+        finally:
+            self.file.close()
+            self.file.delete(save=False)
+            # bulk writes send no signal, and a failed import may still
+            # have written some chunks
+            from .generic import invalidate_counts
+            invalidate_counts(model)
+            if model in (Company, Contact):
+                typeahead.invalidate(self.group_id)
+            SavedSearch.mark_stale(self.type, group_id=self.group_id)
+        self.end_date = timezone.now()
+        self.save()
+        logger.info('Fin de l’{} (job {}) : {} lignes, {} créations, '
+                    '{} modifications, {} erreurs'
+                    .format(self, self.pk, self.rows_count,
+                            self.inserted_count, self.updated_count,
+                            self.errors_count))
+
+    class Meta:
+        verbose_name = 'import'
+        words = {'of': 'd’',
+                 'of_a': 'd’un ',
+                 'of_the': 'de l’',
+                 'an': 'un',
+                 }
+        get_latest_by = 'creation_date'
+        ordering = ['-creation_date']
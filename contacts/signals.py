@@ -0,0 +1,60 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Company, Contact, Meeting, Alert, SavedSearch
+from . import typeahead, autocomplete, generic
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def invalidate_typeahead(sender, instance, **kwargs):
+    typeahead.invalidate(instance.group_id)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+@receiver(post_save, sender=Meeting)
+@receiver(post_delete, sender=Meeting)
+@receiver(post_save, sender=Alert)
+@receiver(post_delete, sender=Alert)
+@receiver(post_save, sender=SavedSearch)
+@receiver(post_delete, sender=SavedSearch)
+def invalidate_counts(sender, instance, **kwargs):
+    generic.invalidate_counts(sender)
+
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Contact)
+def forget_autocomplete_choice(sender, instance, **kwargs):
+    autocomplete.forget(sender, instance.group_id, instance.pk)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+@receiver(post_save, sender=Meeting)
+@receiver(post_delete, sender=Meeting)
+@receiver(post_save, sender=Alert)
+@receiver(post_delete, sender=Alert)
+def mark_searches_stale(sender, instance, **kwargs):
+    if hasattr(instance, 'group_id'):
+        SavedSearch.mark_stale(sender.__name__, group_id=instance.group_id)
+    elif instance.contact_id is not None:
+        SavedSearch.mark_stale(sender.__name__,
+                               contact_id=instance.contact_id)
+    else:
+        # without contact, the item may have left a group of its users
+        SavedSearch.mark_stale(sender.__name__,
+                               user_ids={instance.author_id,
+                                         getattr(instance, 'user_id', None)})
+
+
+@receiver(post_save, sender=SavedSearch)
+@receiver(post_delete, sender=SavedSearch)
+def invalidate_searches_menu(sender, instance, **kwargs):
+    SavedSearch.invalidate_menu(instance.group_id)
@@ -0,0 +1,19 @@
+$(function(){
+    var job = $('#import-job');
+    var finished = ['done', 'failed'];
+
+    function poll() {
+        $.getJSON(job.data('status-url'), function(data) {
+            $.each(data, function(key, value) {
+                job.find('[data-field="' + key + '"]').text(value);
+            });
+            if (finished.indexOf(data.status) === -1) {
+                setTimeout(poll, 2000);
+            }
+        });
+    }
+
+    if (job.length && finished.indexOf(job.data('status')) === -1) {
+        poll();
+    }
+});
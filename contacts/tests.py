@@ -1,6 +1,26 @@
+import io
+import os
+import gzip
+import time
+import threading
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
 import pytest
+from django.db import connection
+from django.utils import timezone
+from django.core.files.base import ContentFile
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import Permission
+from django.template.loader import render_to_string
 
-from . import models
+from . import (
+    models, exports, imports, forms, generic, typeahead, autocomplete
+)
+from .authentication import filter_perm
+from .decorators import versioned_key, bump_version
+from .middleware import DefaultGroupMiddleware
+from .management.commands import import_worker
 
 
 def test_apply_mapping():
@@ -27,3 +47,707 @@ def test_apply_mapping():
     except models.DataImportError:
         exception_raised = True
     assert exception_raised
+
+
+def test_chunks():
+    res = list(models.chunks(range(5), 2))
+    assert res == [[0, 1], [2, 3], [4]]
+
+    res = list(models.chunks(iter([]), 2))
+    assert res == []
+
+    res = list(models.chunks('abc', 3))
+    assert res == [['a', 'b', 'c']]
+
+
+def test_combine_rows():
+    mapping = {'company': 'société'}
+    # a Saru file: meeting-rows inherit the last FK-row
+    data = [{'firstname': 'Jean', 'lastname': 'Dupont', 'société': 'ACME',
+             'date': ''},
+            {'firstname': '', 'lastname': '', 'société': '',
+             'date': '2015-01-01'},
+            {'firstname': '', 'lastname': '', 'société': '',
+             'date': '2015-01-02'},
+            ]
+    res = list(models.combine_rows(data, mapping))
+    assert len(res) == 2
+    assert res[0]['firstname'] == 'Jean'
+    assert res[1]['société'] == 'ACME'
+    assert res[1]['date'] == '2015-01-02'
+
+    # a flat file is left untouched
+    data = [{'firstname': 'Jean', 'lastname': 'Dupont', 'société': 'ACME',
+             'date': '2015-01-01'}]
+    res = list(models.combine_rows(iter(data), mapping))
+    assert res == data
+
+
+def test_export_formatters():
+    export = models.QuerysetExport(models.Alert.objects.all())
+    assert export.header[:3] == ['title', 'firstname', 'lastname']
+    formatters = dict(zip(export.header, export.get_formatters()))
+    assert formatters['title'] is None
+    assert formatters['done'](True) == 1
+    assert formatters['date'](datetime(2015, 1, 1)) == '2015-01-01T00:00:00'
+
+
+def test_export_ordering(user):
+    group = user.default_group.group
+    for name in ('Initech', 'ACME', 'Umbrella', 'Globex', 'Hooli'):
+        models.Company.objects.create(name=name, group=group, author=user)
+    qs = models.Company.objects.order_by('-name')
+    expected = list(qs.values_list('name', 'comments'))
+    with CaptureQueriesContext(connection) as queries:
+        rows = list(models.QuerysetExport(qs, chunk_size=2))
+    assert [row[::2] for row in rows] == expected
+    assert len(queries) == 4
+    # the primary key breaks the ties between the chunks, even on NULL
+    rows = list(models.QuerysetExport(
+        models.Company.objects.order_by('-type__name'), chunk_size=2))
+    assert [row[0] for row in rows] == \
+        ['Initech', 'ACME', 'Umbrella', 'Globex', 'Hooli']
+
+
+def test_columnar_roundtrip():
+    header = ['name', 'count']
+    rows = [('ACME', 1), ('Société', 2), ('', 3)]
+    data = b''.join(exports.write_columnar(header, iter(rows), group_size=2))
+    res_header, res_rows = exports.read_columnar(io.BytesIO(data))
+    assert res_header == header
+    assert list(res_rows) == rows
+
+
+def test_csv_gzip():
+    header = ['name']
+    rows = [('ACME', ), ('Société', )]
+    data = b''.join(exports.write_csv_gzip(header, rows))
+    assert gzip.decompress(data).decode() == \
+        ''.join(exports.write_csv(header, rows))
+
+
+def test_detect_encoding_head():
+    # the only accented rows come after the part seen by the detection
+    data = b'nom;ville\n' + b'ACME;Lyon\n' * (imports.DETECTION_SIZE // 10) \
+        + b'Soci\xc3\xa9t\xc3\xa9;Lyon\nSoci\xe9t\xe9;Ch\xe2lons\n'
+    detection, chunks = imports.detect_encoding(
+        imports.read_chunks(io.BytesIO(data)))
+    assert detection['encoding'] == 'utf-8'
+    detection['errors'] = 'surrogateescape'
+    rows = list(imports.reencode_data(imports.read_csv(chunks, detection),
+                                      detection))
+    assert len(rows) == imports.DETECTION_SIZE // 10 + 2
+    assert [row['nom'] for row in rows[-2:]] == ['Société', 'Société']
+    assert rows[-1]['ville'] == 'Châlons'
+
+
+def test_property_filter():
+    form = forms.SearchForm()
+    res = form._apply_filter('properties__ville', '=Lyon')
+    assert res == {'properties__contains': {'ville': 'Lyon'}}
+
+    res = form._apply_filter('properties__ville', 'Ly*')
+    assert res == {'properties__has_key': 'ville',
+                   'properties__ville__startswith': 'Ly'}
+
+    res = form._apply_filter('properties__ville', 'yon')
+    assert res == {'properties__has_key': 'ville',
+                   'properties__ville__icontains': 'yon'}
+
+
+def test_search_compile():
+    form = forms.ContactSearchForm(data={'name': 'Jean Dupont',
+                                         'company': 'ACME',
+                                         'q': 'salon'})
+    query, fulltext = form.compile()
+    assert fulltext == 'salon'
+    assert query.connector == 'AND'
+    assert len(query.children) == 2
+    assert "('company__name__icontains', 'ACME')" in str(query)
+
+    query, fulltext = forms.ContactSearchForm(data={}).compile()
+    assert len(query) == 0
+    assert fulltext is None
+
+
+def test_keyset_ordering():
+    qs = models.Meeting.objects.all()
+    assert generic.keyset_ordering(qs) == [('date', True, False),
+                                           ('pk', False, False)]
+
+    qs = models.Contact.objects.order_by('company__name')
+    assert generic.keyset_ordering(qs) == [('company__name', False, True),
+                                           ('pk', False, False)]
+
+    assert generic.keyset_ordering(qs.order_by('company')) is None
+    assert generic.keyset_ordering(qs.order_by('?')) is None
+
+
+def test_keyset_cursor():
+    qs = models.Meeting.objects.all()
+    paginator = generic.KeysetPaginator(qs, 10,
+                                        generic.keyset_ordering(qs))
+    meeting = models.Meeting(pk=3, date=datetime(2015, 1, 1))
+    cursor = paginator.cursor_for(meeting)
+    assert paginator.decode_cursor(cursor) == ['2015-01-01T00:00:00', 3]
+
+    query = paginator.after(paginator.ordering, [None, 3])
+    assert query.connector == 'OR'
+    assert len(query.children) == 2
+
+
+def test_versioned_key(monkeypatch):
+    key = versioned_key('test')
+    assert versioned_key('test') == key
+    assert key.startswith('test-')
+    monkeypatch.setattr(time, 'time', lambda: 0)
+    bump_version('test')
+    assert versioned_key('test') == 'test-0'
+
+
+def test_typeahead_refinement():
+    assert typeahead.split_words(' Jean  dupont jean') == ('dupont', 'jean')
+
+    rows = [{'search_name': ' jean dupont acme'},
+            {'search_name': ' jeanne durand'}]
+    typeahead._store((1, 1, ('du', )), (rows, True, time.time() + 60))
+    res = typeahead._cached(1, 1, ('dur', ))
+    assert res[0] == [rows[1]]
+    assert typeahead._cached(1, 2, ('dur', )) is None
+
+    assert typeahead.matches(rows[0], ('jéan', 'acm'))
+    assert not typeahead.matches(rows[0], ('ean', ))
+
+
+def test_autocomplete_index():
+    index = autocomplete.NameIndex(models.Company, 1, ('name', ),
+                                   lambda name: (name, [name]))
+    rows = [(1, datetime(2015, 1, 1), 'Électricité de France'),
+            (2, datetime(2015, 1, 2), 'ACME'),
+            (3, datetime(2015, 1, 3), 'Acme Industries')]
+    for row in rows:
+        index._add(row)
+    res = index.search('acm', 10)
+    assert [choice.pk for choice in res] == [2, 3]
+    assert str(res[1]) == 'Acme Industries'
+    assert [choice.pk for choice in index.search('ele', 10)] == [1]
+    assert [choice.pk for choice in index.search('acm', 10, {2})] == [3]
+
+    index.remove(2)
+    assert [choice.pk for choice in index.search('acm', 10)] == [3]
+    assert index.last_update == datetime(2015, 1, 3)
+
+
+def test_autocomplete_loading(monkeypatch):
+    loading, loaded = threading.Event(), threading.Event()
+
+    def load(index):
+        if index.group_id == 1:
+            loading.set()
+            loaded.wait(5)
+        index.load_time = index.refresh_time = time.time()
+
+    monkeypatch.setattr(autocomplete, '_indexes', OrderedDict())
+    monkeypatch.setattr(autocomplete.NameIndex, 'load', load)
+    args = ('a', 10, ('name', ), lambda name: (name, [name]))
+    thread = threading.Thread(target=autocomplete.complete,
+                              args=(models.Company, 1) + args)
+    thread.start()
+    try:
+        assert loading.wait(5)
+        # the group 2 doesn't wait for the index of the group 1
+        assert autocomplete.complete(models.Company, 2, *args) == []
+        assert thread.is_alive()
+    finally:
+        loaded.set()
+        thread.join()
+    assert list(autocomplete._indexes) == [(models.Company, 2),
+                                           (models.Company, 1)]
+
+
+@pytest.mark.django_db
+def test_default_group_middleware(rf):
+    user = models.User.objects.create(username='jean')
+    acme = models.Group.objects.create(name='acme')
+    initech = models.Group.objects.create(name='initech')
+    models.DefaultGroup.objects.create(user=user, group=acme)
+
+    request = rf.get('/')
+    request.user = models.User.objects.get(pk=user.pk)
+    with CaptureQueriesContext(connection) as queries:
+        DefaultGroupMiddleware().process_request(request)
+        assert request.user.default_group.group.name == 'acme'
+        assert models.Company.get_queryset(request.user).count() == 0
+    assert len(queries) == 2
+
+    # changed by another process, whose signals never reach this one
+    models.DefaultGroup.objects.filter(user=user).update(group=initech)
+    request = rf.get('/')
+    request.user = models.User.objects.get(pk=user.pk)
+    DefaultGroupMiddleware().process_request(request)
+    assert request.user.default_group.group.name == 'initech'
+
+
+def test_filter_perm():
+    user = models.User(pk=1, username='jean')
+    user.default_group = models.DefaultGroup(
+        pk=2, user=user, group=models.Group(pk=3, name='acme'))
+    user._perm_cache = {'contacts.view_company'}
+    companies = [models.Company(pk=1, name='ACME', group_id=3),
+                 models.Company(pk=2, name='Initech', group_id=4)]
+    assert filter_perm(user, 'contacts.view_company', companies) == \
+        companies[:1]
+    assert filter_perm(user, 'contacts.delete_company', companies) == []
+    # a meeting without contact belongs to no group
+    assert not models.Meeting().is_owned(user)
+    user.is_superuser = True
+    assert filter_perm(user, 'contacts.delete_company', companies) == \
+        companies
+    assert models.Alert(user_id=5, author_id=1).is_owned(user)
+    assert not models.Alert(user_id=5, author_id=6).is_owned(user)
+
+
+@pytest.fixture
+def user(db):
+    user = models.User.objects.create(username='jean')
+    group = models.Group.objects.create(name='acme')
+    user.groups.add(group)
+    models.DefaultGroup.objects.create(user=user, group=group)
+    return models.User.objects.select_related('default_group__group')\
+        .get(pk=user.pk)
+
+
+def test_import_contacts_chunk(user):
+    company = models.Company.objects.create(
+        name='ACME', group=user.default_group.group, author=user)
+    models.Contact.objects.create(firstname='Jean', lastname='Dupont',
+                                  company=company, author=user,
+                                  group=user.default_group.group)
+    rows = [{'firstname': 'Jean', 'lastname': 'Dupont', 'company': 'ACME',
+             'type': '', 'comments': 'a'},
+            {'firstname': 'Paul', 'lastname': 'Durand', 'company': 'ACME',
+             'type': '', 'comments': 'b'},
+            {'firstname': 'Paul', 'lastname': 'Durand', 'company': 'ACME',
+             'type': '', 'comments': 'c'}]
+    with CaptureQueriesContext(connection) as queries:
+        created, updated, errors = models.Contact.import_data(
+            rows, {}, None, user, batch_size=10)
+    assert errors == 0
+    assert [c.firstname for c in created] == ['Paul']
+    assert sorted(c.firstname for c in updated) == ['Jean', 'Paul']
+    assert models.Contact.objects.get(firstname='Paul').comments == 'c'
+    # the chunk is not replayed row by row
+    assert not any('ROLLBACK TO SAVEPOINT' in query['sql']
+                   for query in queries)
+    # the companies of the existing contacts are not fetched one by one
+    assert not any('FROM "contacts_company" WHERE "contacts_company"."id"'
+                   in query['sql'] for query in queries)
+
+
+def test_import_contacts_chunk_ambiguous(user):
+    group = user.default_group.group
+    for comments in ('a', 'b'):
+        models.Contact.objects.create(firstname='Jean', lastname='Dupont',
+                                      slug='jean-dupont-' + comments,
+                                      author=user, group=group,
+                                      comments=comments)
+    rows = [{'firstname': 'Jean', 'lastname': 'Dupont', 'company': '',
+             'type': '', 'comments': 'c'},
+            {'firstname': 'Paul', 'lastname': 'Durand', 'company': '',
+             'type': '', 'comments': 'd', 'ville': 'Lyon'},
+            {'firstname': 'Paul', 'lastname': 'Durand', 'company': '',
+             'type': '', 'comments': 'e', 'ville': 'Paris'}]
+    created, updated, errors = models.Contact.import_data(
+        rows, {}, None, user, batch_size=10)
+    # as with the row by row import, several matching contacts is an error
+    assert errors == 1
+    assert sorted(models.Contact.objects.filter(firstname='Jean')
+                  .values_list('comments', flat=True)) == ['a', 'b']
+    assert [c.firstname for c in created] == ['Paul']
+    assert [c.firstname for c in updated] == ['Paul']
+    assert models.Contact.objects.get(firstname='Paul').properties == \
+        {'ville': 'Paris'}
+
+
+def test_property_names():
+    row = {'Nom': 'ACME', 'type': '', 'comments': '', 'ville': 'Lyon',
+           'pays': 'France', None: ''}
+    mapping = {'name': 'Nom'}
+    fields = models.Company._meta.import_fields
+    assert sorted(models.property_names(row, mapping, fields)) == \
+        ['pays', 'ville']
+    assert models.property_names(row, mapping, fields, ['ville']) == \
+        ['ville']
+
+
+def test_import_companies_properties(user):
+    rows = [{'name': 'ACME', 'type': '', 'comments': '', 'ville': 'Lyon'}]
+    created, updated, errors = models.Company.import_data(rows, {}, None,
+                                                          user)
+    assert (len(created), errors) == (1, 0)
+    assert created[0].properties == {'ville': 'Lyon'}
+    assert list(models.Properties.objects.values_list('type', 'name')) == \
+        [('company', 'ville')]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sharded_import(user):
+    rows = [{'firstname': 'Jean', 'lastname': str(i),
+             'company': 'Société {}'.format(i % 3), 'type': 'client',
+             'comments': '', 'ville': 'Lyon'} for i in range(10)]
+    inserted, updated, errors = models.sharded_import(
+        models.Contact, iter(rows), {}, None, user, 3, batch_size=2)
+    assert (len(inserted), len(updated), errors) == (10, 0, 0)
+    assert all(isinstance(pk, int) for pk in inserted)
+    assert models.Company.objects.count() == 3
+    assert models.ContactType.objects.count() == 1
+    assert models.Properties.objects.count() == 1
+
+
+def test_counters(user):
+    group = user.default_group.group
+    acme = models.Company.objects.create(name='ACME', group=group,
+                                         author=user)
+    initech = models.Company.objects.create(name='Initech', group=group,
+                                            author=user)
+    contact = models.Contact.objects.create(firstname='Jean',
+                                            lastname='Dupont', company=acme,
+                                            group=group, author=user)
+    alert = models.Alert.objects.create(contact=contact, title='Relance',
+                                        user=user, author=user)
+
+    def counts():
+        return (models.Company.objects.get(pk=acme.pk).contacts_count,
+                models.Company.objects.get(pk=initech.pk).contacts_count,
+                models.Contact.objects.get(pk=contact.pk).open_alerts_count)
+
+    def company_version():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT ctid FROM contacts_company WHERE id = %s',
+                           [acme.pk])
+            return cursor.fetchone()[0]
+
+    assert counts() == (1, 0, 1)
+    # writes which leave the counted key alone don't touch the counters
+    version = company_version()
+    contact.comments = 'Client'
+    contact.save()
+    assert company_version() == version
+    alert.title = 'Rappel'
+    alert.save()
+    assert counts() == (1, 0, 1)
+
+    alert.done = True
+    alert.save()
+    contact.company = initech
+    contact.save()
+    assert counts() == (0, 1, 0)
+
+
+def test_order_alerts(user, client):
+    group = user.default_group.group
+    jean, paul = [models.Contact.objects.create(
+        firstname=name, group=group, author=user) for name in ('Jean', 'Paul')]
+    for done in (True, True, False):
+        models.Alert.objects.create(contact=jean if done else paul,
+                                    title='Relance', done=done, user=user,
+                                    author=user)
+    user.user_permissions.add(Permission.objects.get(codename='view_contact'))
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='jean', password='secret')
+
+    def first(order):
+        content = client.get('/contacts', {'order': order}).content.decode()
+        return 'Jean' if content.index('Jean') < content.index('Paul') \
+            else 'Paul'
+    # the alerts are all counted, the open ones by their counter
+    assert first('-alerts') == 'Jean'
+    assert first('-open_alerts') == 'Paul'
+
+
+def test_searches_menu(user):
+    group = user.default_group.group
+    models.SavedSearch.objects.create(name='Lyon', type='Contact',
+                                      group=group, author=user)
+    with CaptureQueriesContext(connection) as queries:
+        menu = models.SavedSearch.get_menu(group.pk)
+        assert models.SavedSearch.get_menu(group.pk) == menu
+    assert len(queries) == 1
+    assert [search['name'] for search in menu['Contact']] == ['Lyon']
+    assert menu['Company'] == []
+
+    models.SavedSearch.objects.create(name='Annecy', type='Contact',
+                                      group=group, author=user)
+    menu = models.SavedSearch.get_menu(group.pk)
+    assert [search['name'] for search in menu['Contact']] == \
+        ['Annecy', 'Lyon']
+
+
+def test_searches_stale(user):
+    group = user.default_group.group
+    company = models.Company.objects.create(name='ACME', group=group,
+                                            author=user)
+    contact = models.Contact.objects.create(firstname='Jean',
+                                            lastname='Dupont',
+                                            company=company, group=group,
+                                            author=user)
+    alert = models.Alert.objects.create(title='Relance', contact=contact,
+                                        user=user, author=user)
+    contacts = models.SavedSearch.objects.create(
+        name='ACME', type='Contact', group=group, author=user,
+        data={'company': 'ACME'})
+    alerts = models.SavedSearch.objects.create(
+        name='Alertes', type='Alert', group=group, author=user)
+
+    def refresh():
+        counted = models.SavedSearch.refresh_counts()
+        contacts.refresh_from_db()
+        alerts.refresh_from_db()
+        return counted
+
+    assert refresh() == 2
+    assert (contacts.results_count, alerts.results_count) == (1, 1)
+    assert not contacts.count_stale
+
+    # contact and alert searches match on the name of the company
+    company.name = 'Initech'
+    company.save()
+    contacts.refresh_from_db()
+    alerts.refresh_from_db()
+    assert contacts.count_stale and alerts.count_stale
+    assert refresh() == 2
+    assert (contacts.results_count, alerts.results_count) == (0, 1)
+    with CaptureQueriesContext(connection) as queries:
+        assert models.SavedSearch.refresh_counts() == 0
+    assert len(queries) == 1
+
+    # an alert leaving its contact flags the searches of its users' groups
+    alert.contact = None
+    alert.save()
+    alerts.refresh_from_db()
+    assert alerts.count_stale
+    assert refresh() == 1
+    assert alerts.results_count == 0
+
+
+def test_searches_count_errors(user, monkeypatch):
+    group = user.default_group.group
+    searches = [models.SavedSearch.objects.create(
+        name=name, type='Company', group=group, author=user)
+        for name in ('ACME', 'Initech')]
+    count_results = models.SavedSearch.count_results
+
+    def fail_first(search):
+        if search.pk == searches[0].pk:
+            raise ValueError('données invalides')
+        return count_results(search)
+
+    monkeypatch.setattr(models.SavedSearch, 'count_results', fail_first)
+    assert models.SavedSearch.refresh_counts() == 2
+    assert list(models.SavedSearch.objects.filter(count_stale=True)
+                .values_list('pk', flat=True)) == [searches[0].pk]
+
+
+def test_materialized_search(user, client):
+    group = user.default_group.group
+    models.Company.objects.create(name='ACME', group=group, author=user)
+    search = models.SavedSearch.objects.create(
+        name='ACME', type='Company', group=group, author=user,
+        data={'name': 'ACME'}, materialized=True)
+    search.materialize()
+    assert search.results.count() == 1
+
+    # counts don't wait for the stored results to be refreshed
+    models.Company.objects.create(name='ACME Lyon', group=group, author=user)
+    assert search.count_results() == 2
+    search.materialize()
+    assert search.get_search_queryset(user).count() == 2
+
+    # changing the flag drops the stored results
+    user.is_superuser = True
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='jean', password='secret')
+    response = client.post(search.get_absolute_url() + '/update',
+                           {'name': 'ACME'})
+    assert response.status_code == 302
+    search.refresh_from_db()
+    assert not search.materialized
+    assert search.materialized_date is None
+    assert search.results.count() == 0
+
+
+def test_search_detail_paginated(user, client):
+    group = user.default_group.group
+    for i in range(12):
+        models.Company.objects.create(name='ACME {:02}'.format(i),
+                                      group=group, author=user)
+    search = models.SavedSearch.objects.create(
+        name='ACME', type='Company', group=group, author=user,
+        data={'name': 'ACME'})
+    user.is_superuser = True
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='jean', password='secret')
+    content = client.get(search.get_absolute_url()).content.decode()
+    assert 'Affichage de 10\nsociétés sur 12.' in content
+    assert 'ACME 09' in content and 'ACME 10' not in content
+    content = client.get(search.get_absolute_url(), {'page': 2})\
+        .content.decode()
+    assert 'ACME 11' in content and 'ACME 09' not in content
+    assert client.get(search.get_absolute_url(),
+                      {'page': 3}).status_code == 404
+
+
+def test_search_explain(user, client, settings):
+    user.is_superuser = True
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='jean', password='secret')
+    # debugging does not run an EXPLAIN query for each search
+    settings.DEBUG = True
+    with CaptureQueriesContext(connection) as queries:
+        content = client.get('/companies', {'name': 'ACME'}).content.decode()
+    assert 'search-plan' not in content
+    assert not any(query['sql'].startswith('EXPLAIN') for query in queries)
+    settings.SEARCH_EXPLAIN = True
+    content = client.get('/companies', {'name': 'ACME'}).content.decode()
+    assert 'search-plan' in content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_sync_property_indexes(user):
+    def indexes():
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT indexname FROM pg_indexes "
+                           "WHERE tablename = 'contacts_contact'")
+            return {row[0] for row in cursor.fetchall()}
+
+    prop = models.Properties.objects.create(
+        name='ville', type='contact', display_on_list=True,
+        group=user.default_group.group, author=user)
+    index = models.property_index_name('contact', 'ville')
+    assert index not in indexes()
+    assert models.sync_property_indexes() == (1, 0)
+    assert index in indexes()
+    assert models.sync_property_indexes() == (0, 0)
+
+    prop.display_on_list = False
+    prop.save()
+    assert models.sync_property_indexes() == (0, 1)
+    assert index not in indexes()
+
+    # the import workers sync them when the properties change
+    version = import_worker.sync_indexes(None)
+    assert version == models.properties_version()
+    prop.display_on_list = True
+    prop.save()
+    assert import_worker.sync_indexes(version) != version
+    assert index in indexes()
+    prop.delete()
+    import_worker.work(0, True, 1)
+    assert index not in indexes()
+
+
+def test_import_job(user, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    job = models.ImportJob.objects.create(
+        group=user.default_group.group, author=user, type='Company',
+        file=ContentFile(b'nom;type;notes\nACME;;client\nInitech;;\n',
+                         name='company.csv'),
+        encoding='ascii',
+        mapping={'name': 'nom', 'type': 'type', 'comments': 'notes'})
+    path = job.file.path
+    assert models.ImportJob.claim().pk == job.pk
+    assert models.ImportJob.claim() is None
+
+    # a job whose worker stopped reporting progress is taken again
+    models.ImportJob.objects.filter(pk=job.pk).update(
+        rows_count=1, update_date=timezone.now() - timedelta(hours=1))
+    job = models.ImportJob.claim()
+    assert (job.status, job.rows_count) == ('running', 0)
+    # rows read ahead are not counted before they are imported
+    job.rows_count = 2
+    job.progress(1, 0, 0)
+    assert models.ImportJob.objects.get(pk=job.pk).rows_count == 1
+
+    job.rows_count = 0
+    job.run()
+    job.refresh_from_db()
+    assert job.status == 'done'
+    assert (job.rows_count, job.inserted_count, job.errors_count) == \
+        (2, 2, 0)
+    assert not os.path.exists(path)
+    assert models.ImportJob.claim() is None
+
+
+def test_import_job_failed_invalidates(user, settings, tmpdir, monkeypatch):
+    settings.MEDIA_ROOT = str(tmpdir)
+    group = user.default_group.group
+    job = models.ImportJob.objects.create(
+        group=group, author=user, type='Contact',
+        file=ContentFile(b'prenom\nJean\n', name='contact.csv'),
+        encoding='ascii', mapping={'firstname': 'prenom'})
+    qs = models.Contact.get_queryset(user)
+    assert generic.count_queryset(qs) == (0, True)
+
+    def import_data(*args, **kwargs):
+        # a first chunk is written, then the import fails
+        models.Contact.objects.bulk_create([models.Contact(
+            firstname='Jean', slug='jean', group=group, author=user)])
+        raise ValueError('disque plein')
+    monkeypatch.setattr(models.Contact, 'import_data', import_data)
+    job.run()
+    assert job.status == 'failed'
+    assert generic.count_queryset(qs) == (1, True)
+
+
+def test_contact_alerts_permissions(user, client):
+    group = user.default_group.group
+    other = models.User.objects.create(username='paul')
+    contact = models.Contact.objects.create(firstname='Jean',
+                                            lastname='Dupont', group=group,
+                                            author=user)
+    tomorrow = timezone.now() + timedelta(days=1)
+    mine, theirs = [models.Alert.objects.create(
+        contact=contact, title=title, date=tomorrow, user=owner,
+        author=owner) for title, owner in (('Relance', user),
+                                           ('Rappel', other))]
+    user.user_permissions.add(*Permission.objects.filter(
+        codename__in=('view_contact', 'view_alert', 'change_alert')))
+    user.set_password('secret')
+    user.save()
+    assert client.login(username='jean', password='secret')
+    content = client.get(contact.get_absolute_url()).content.decode()
+    assert '/alert/{}/update'.format(mine.pk) in content
+    assert '/alert/{}/update'.format(theirs.pk) not in content
+    assert '/alert/{}/delete'.format(mine.pk) not in content
+
+
+def test_count_queryset(user):
+    group = user.default_group.group
+    company = models.Company.objects.create(name='ACME', group=group,
+                                            author=user)
+    models.Contact.objects.create(firstname='Jean', lastname='Dupont',
+                                  company=company, group=group, author=user)
+    qs = models.Contact.objects.filter(company__name='ACME')
+    assert generic.count_queryset(qs) == (1, True)
+    with CaptureQueriesContext(connection) as queries:
+        assert generic.count_queryset(qs) == (1, True)
+    assert len(queries) == 0
+
+    # writes to any table of the query invalidate the count
+    company.name = 'Initech'
+    company.save()
+    assert generic.count_queryset(qs) == (0, True)
+
+    paginator = generic.CachedCountPaginator(models.Contact.objects.all(), 10)
+    context = {'count_of': 'contact', 'is_paginated': True,
+               'object_list': paginator.page(1).object_list,
+               'paginator': paginator}
+    content = render_to_string('contacts/partials/objects-count.html', context)
+    assert 'Affichage de 1\ncontact sur 1.' in content
+    paginator.count_is_approximate = True
+    content = render_to_string('contacts/partials/objects-count.html', context)
+    assert 'sur environ 1.' in content
@@ -0,0 +1,120 @@
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from unidecode import unidecode
+
+from .decorators import versioned_key, bump_version
+
+
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_CACHE_SIZE = 1024
+TYPEAHEAD_CACHE_TIMEOUT = 60
+
+# (group id, version, words) -> (rows, complete, expiry time), most recently
+# used last
+_results = OrderedDict()
+
+
+def get_version(group_id):
+    """
+    Returns the version of the contacts of a group, which changes each time
+    one of its contacts or companies is written.
+    """
+    return versioned_key('typeahead-{}'.format(group_id))
+
+
+def invalidate(group_id):
+    bump_version('typeahead-{}'.format(group_id))
+
+
+def split_words(query):
+    """
+    Splits a query into words, sorted and deduplicated since each of them
+    has to match.
+    """
+    return tuple(sorted(set(query.lower().split())))
+
+
+def matches(row, words):
+    return all(' {}'.format(unidecode(word)) in row['search_name']
+               for word in words)
+
+
+def _store(key, value):
+    _results[key] = value
+    _results.move_to_end(key)
+    while len(_results) > TYPEAHEAD_CACHE_SIZE:
+        _results.popitem(last=False)
+
+
+def _cached(group_id, version, words):
+    """
+    Returns the cached result of a query or, if the query is the previous
+    one with one more character typed and that result was complete, the
+    refined previous result.
+    """
+    key = (group_id, version, words)
+    now = time.time()
+    if key in _results and _results[key][2] > now:
+        _results.move_to_end(key)
+        return _results[key]
+    for i, word in enumerate(words):
+        if len(word) < 2:
+            continue
+        shorter = words[:i] + (word[:-1], ) + words[i + 1:]
+        previous = _results.get((group_id, version,
+                                 tuple(sorted(set(shorter)))))
+        if previous is not None and previous[1] and previous[2] > now:
+            refined = ([row for row in previous[0] if matches(row, words)],
+                       True, previous[2])
+            _store(key, refined)
+            return refined
+    return None
+
+
+def find_contacts(group_id, words, limit=TYPEAHEAD_LIMIT):
+    """
+    Queries the contacts of a group whose normalized name (see the
+    search_name column) has a word starting with each of the given words.
+    Rows are fetched with values(), without building any model instance.
+    """
+    from .models import Contact
+    qs = Contact.objects.filter(group_id=group_id)
+    for word in words:
+        word = word.replace('\\', '\\\\').replace('%', '\\%')\
+            .replace('_', '\\_')
+        qs = qs.extra(where=["contacts_contact.search_name LIKE "
+                             "'%% ' || lower(unaccent(%s)) || '%%'"],
+                      params=[word])
+    return list(qs.order_by().values('slug', 'firstname', 'lastname',
+                                     'company__name', 'search_name')
+                [:limit + 1])
+
+
+def search(group_id, query, limit=TYPEAHEAD_LIMIT):
+    """
+    Returns the contacts of a group matching a typeahead query, as a list of
+    dicts with their name and URL.
+    Results are kept in a per-process LRU cache, keyed by the version of the
+    group, and expire after TYPEAHEAD_CACHE_TIMEOUT seconds at most.
+    """
+    words = split_words(query)
+    version = get_version(group_id)
+    cached = _cached(group_id, version, words)
+    if cached is None:
+        rows = find_contacts(group_id, words, limit)
+        cached = (rows[:limit], len(rows) <= limit,
+                  time.time() + TYPEAHEAD_CACHE_TIMEOUT)
+        _store((group_id, version, words), cached)
+    url = reverse('contacts:contact-detail', kwargs={'slug': 'slug'})\
+        .rsplit('slug', 1)
+    results = []
+    for row in cached[0][:limit]:
+        name = '{} {}'.format(row['firstname'], row['lastname'])
+        if row['company__name'] is not None:
+            name = '{} ({})'.format(name, row['company__name'])
+        results.append({'name': name,
+                        'url': row['slug'].join(url)})
+    return results
@@ -17,10 +17,17 @@ urlpatterns = [
     url(r'^(?P<type>(' + saved_searches_types + '))/import/?$',
         views.Import.as_view(),
         name='import'),
+    url(r'^(?P<type>(' + saved_searches_types + '))/import/(?P<pk>\d+)/?$',
+        views.ImportJobDetail.as_view(),
+        name='import-job'),
+    url(r'^(?P<type>(' + saved_searches_types + '))/import/(?P<pk>\d+)/'
+        'status/?$',
+        views.ImportJobStatus.as_view(),
+        name='import-job-status'),
     url(r'^(?P<type>(' + saved_searches_types + '))/export/?$',
         views.Export.as_view(),
         name='export'),
-    url(r'^/search/(?P<slug>[-\w]+)/export/?$',
+    url(r'^search/(?P<slug>[-\w]+)/export/?$',
         views.Export.as_view(),
         name='export'),
     url(r'^search/?$', views.ContactFastSearch.as_view(),
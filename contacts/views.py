@@ -1,62 +1,34 @@
-import csv
-from io import StringIO
-import json
-import operator
-from functools import reduce
-
-from django.http.response import HttpResponse
+from django.http import Http404
+from django.http.response import (
+    JsonResponse, StreamingHttpResponse
+)
+from django.core.files.base import ContentFile
+from django.core.paginator import InvalidPage
 from django.utils import timezone
-from django.shortcuts import get_object_or_404, redirect, resolve_url
+from django.shortcuts import get_object_or_404, redirect
 from django.core.urlresolvers import reverse_lazy
 from django import forms
 from django.views.generic.edit import ModelFormMixin, FormView
-from django.views.generic import ListView
+from django.views.generic import ListView, DetailView
 from django.db import IntegrityError
 from django.db.models import Q
 from django.contrib import messages
 from django.contrib.auth.models import Group
 from django.forms.widgets import HiddenInput
-import chardet
 
 from . import generic
+from .imports import detect_encoding, read_chunks
+from .exports import FORMATS
+from . import typeahead
 from .models import (
-    Properties, Alert, Company, Contact, Meeting, SavedSearch, SEARCH_CHOICES
+    Properties, Alert, Company, Contact, Meeting, SavedSearch, ImportJob,
+    SEARCH_CHOICES
 )
 from .forms import (
     ContactSearchForm, CompanySearchForm, MeetingSearchForm, AlertSearchForm,
 )
 
 
-def reencode_data(reader, detection):
-    """
-    Iterates through a reader (a list of dicts) and re-encode each value, with
-    encoding guessing.
-    """
-    data = []
-    for row in reader:
-        reencoded_row = {}
-        for key, value in row.items():
-            if key is not None and value is not None:
-                det = chardet.detect(value.encode())
-                if det['encoding'] != detection['encoding']\
-                        and det['confidence'] > .5\
-                        and detection['encoding'] != 'utf-8':
-                    reencoded_row[key] = value.encode(
-                        detection['encoding']).decode(det['encoding'])
-                    # print('reencoding {} from {} to {} ({})'
-                    #       .format(value, detection['encoding'],
-                    #               det['encoding'], reencoded_row[key]))
-                else:
-                    reencoded_row[key] = value.encode(detection['encoding'])\
-                        .decode()
-                    # if det['encoding'] is not None:
-                    #     print('No need to reencode {} (key {}) from {} ({})'
-                    #           .format(value, key, det['encoding'],
-                    #                   det['confidence']))
-        data.append(reencoded_row)
-    return data
-
-
 class Home(generic.ListView):
     model = Alert
     template_name = 'contacts/home.html'
@@ -155,6 +127,10 @@ class CompanyDetail(generic.DetailView):
         context['properties_names'] = Properties.get_displayed_names(
             self.request.user.default_group.group,
             'contact')
+        # alerts of other users are listed, but can't be changed
+        context['alerts'] = list(self.object.active_alerts())
+        context['allowed_alerts'] = generic.object_permissions(
+            self.request.user, Alert, context['alerts'])
         return context
 
 
@@ -442,6 +418,14 @@ class ContactList(generic.SearchFormMixin, generic.ListView):
 class ContactDetail(generic.DetailView):
     model = Contact
 
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        # alerts of other users are listed, but can't be changed
+        context['alerts'] = list(self.object.active_alerts())
+        context['allowed_alerts'] = generic.object_permissions(
+            self.request.user, Alert, context['alerts'])
+        return context
+
 
 class ContactUpdate(generic.UpdateView):
     model = Contact
@@ -616,7 +600,7 @@ class AlertDelete(generic.DeleteView):
 
 class SavedSearchCreation(generic.CreateView):
     model = SavedSearch
-    fields = ('name', 'display_in_menu', 'type', 'data')
+    fields = ('name', 'display_in_menu', 'materialized', 'type', 'data')
 
     def get_form_kwargs(self):
         """
@@ -673,10 +657,24 @@ class SavedSearchDetail(generic.DetailView):
         return ['contacts/{}_search_detail.html'
                 .format(self.get_object().type.lower())]
 
+    paginate_by = 10
+
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        context['object_list'] = \
-            context['object'].get_search_queryset(self.request.user)
+        paginator = generic.CachedCountPaginator(
+            context['object'].get_search_queryset(self.request.user),
+            self.paginate_by)
+        try:
+            page = paginator.page(self.request.GET.get('page', 1))
+        except InvalidPage:
+            raise Http404('Page invalide.')
+        context.update({'paginator': paginator, 'page_obj': page,
+                        'is_paginated': page.has_other_pages(),
+                        'object_list': page.object_list})
+        # the permissions are checked on the displayed page only
+        context['allowed'] = generic.object_permissions(
+            self.request.user, context['object'].get_search_model(),
+            context['object_list'])
         context['search_type'] = context['object'].type.lower()
         return context
 
@@ -703,9 +701,13 @@ class SavedSearchList(generic.ListView):
 
 class SavedSearchUpdate(generic.UpdateView):
     model = SavedSearch
-    fields = ('name', 'display_in_menu')
+    fields = ('name', 'display_in_menu', 'materialized')
 
     def form_valid(self, form):
+        if 'materialized' in form.changed_data:
+            # stored results are evaluated again from scratch when needed
+            form.instance.materialized_date = None
+            form.instance.results.all().delete()
         messages.add_message(self.request, messages.SUCCESS,
                              'Recherche {} modifiée avec succès.'
                              .format(self.object))
@@ -768,80 +770,48 @@ class Import(generic.LoginRequiredMixin, generic.LatePermissionMixin,
                                        'champs']
                 return self.form_invalid(form)
 
-            # parsing the CSV
+            # charset detection; the file itself is parsed by the worker
             if 'file' in form.changed_data:  # upload
-                field = 'file'
-                content = form.cleaned_data['file'].read()
-                detection = chardet.detect(content)
+                upload = form.cleaned_data['file']
+                detection, _ = detect_encoding(read_chunks(upload))
                 if detection['confidence'] < .5:
                     form.errors['file'] = ['Encodage non reconnu']
                     return self.form_invalid(form)
-                content = content.decode(detection['encoding'])
-            else:  # we parse the inline content
-                field = 'content'
+                upload.seek(0)
+            else:  # we save the inline content as a file
+                # the encoding is known, chardet finds none for ASCII text
                 try:
                     content = form.cleaned_data['content'].encode('latin-1')
+                    detection = {'encoding': 'latin-1', 'confidence': 1}
                 except UnicodeEncodeError:
                     content = form.cleaned_data['content'].encode()
-                detection = chardet.detect(content)
-                content = content.decode(detection['encoding'])
-            dialect = csv.Sniffer().sniff(content)
-            if dialect.escapechar is None:
-                dialect.escapechar = '\\'  # hack
-            reader = csv.DictReader(StringIO(content), dialect=dialect)
+                    detection = {'encoding': 'utf-8', 'confidence': 1}
+                upload = ContentFile(content, name='{}.csv'
+                                     .format(self.kwargs['type']))
 
             # mapping extraction
             mapping = {k[:-6]: v for k, v in form.cleaned_data.items()
                        if k.endswith('_field') and v != ''}
 
-            # values charset detection
-            data = reencode_data(reader, detection)
-
-            properties = None
+            job = ImportJob(group=self.request.user.default_group.group,
+                            author=self.request.user,
+                            type=model.__name__,
+                            file=upload,
+                            encoding=detection['encoding'],
+                            mapping=mapping)
             if 'properties_list' in form.cleaned_data and\
                     form.cleaned_data['properties_list'] != '':
-                properties = [p.strip() for p in
-                              form.cleaned_data['properties_list'].split(',')
-                              ]
+                job.properties = [
+                    p.strip() for p in
+                    form.cleaned_data['properties_list'].split(',')]
             if 'date_format' in form.cleaned_data:
-                properties = form.cleaned_data['date_format']  # urk!
-            try:
-                inserted, updated, errors = model\
-                    .import_data(data, mapping, properties,
-                                 self.request.user)
-            except (UnicodeEncodeError, UnicodeDecodeError):
-                form.errors[field] = ['Encodage incorrect']
-                return self.form_invalid(form)
-
-            context = {'object_list': set(sorted(inserted + updated,
-                                                 key=lambda i: i.update_date)),
-                       'errors': errors}
-
-            if len(inserted + updated) > 0:
-                model_name_plural = model._meta.verbose_name_plural\
-                    if len(inserted + updated) > 0\
-                    else model._meta.verbose_name
-                messages.add_message(self.request, messages.SUCCESS,
-                                     'Import de {} {} effectué.'
-                                     .format(len(inserted + updated),
-                                             model_name_plural))
-
-            if errors > 0:
-                plural = 's' if errors > 0 else ''
-                messages.add_message(self.request, messages.ERROR,
-                                     'Import de {} : {} erreur{}.'
-                                     .format(model._meta.verbose_name_plural,
-                                             errors,
-                                             plural))
-
-            return redirect(
-                resolve_url('contacts:{}-list'.format(self.kwargs['type']))
-                + '?id=' + ','.join([str(o.pk) for o in
-                                     context['object_list']]))
-            # return render(self.request,
-            #               'contacts/{}_import.html'
-            #               .format(self.kwargs['type']),
-            #               context)
+                job.date_format = form.cleaned_data['date_format']
+            job.save()
+            messages.add_message(self.request, messages.INFO,
+                                 'Import {}{} programmé.'
+                                 .format(model._meta.words['of'],
+                                         model._meta.verbose_name_plural))
+            return redirect(job)
         else:
             return self.form_invalid(form)
 
@@ -855,6 +825,51 @@ class Import(generic.LoginRequiredMixin, generic.LatePermissionMixin,
         return context
 
 
+class ImportJobDetail(generic.LoginRequiredMixin, generic.LatePermissionMixin,
+                      DetailView):
+    permission_suffix = 'add'
+    template_name = 'contacts/importjob_detail.html'
+
+    @generic.response_from_exception
+    def get(self, *args, **kwargs):
+        return super().get(*args, **kwargs)
+
+    def get_model(self):
+        types = {c[0].lower(): c for c in SEARCH_CHOICES}
+        class_name = types[self.kwargs['type']][0]
+        from . import models
+        return getattr(models, class_name)
+
+    def get_queryset(self):
+        return ImportJob.get_queryset(self.request.user)\
+            .filter(type=self.get_model().__name__)
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(*args, **kwargs)
+        types = {c[0].lower(): c for c in SEARCH_CHOICES}
+        context['import_type'] = types[self.kwargs['type']][0].lower()
+        context['import_type_name'] = types[self.kwargs['type']][1]
+        context['search_type'] = self.kwargs['type']
+        context['words'] = self.get_model()._meta.words
+        return context
+
+
+class ImportJobStatus(ImportJobDetail):
+
+    @generic.response_from_exception
+    def get(self, request, *args, **kwargs):
+        job = self.get_object()
+        return JsonResponse({'status': job.status,
+                             'status_display': job.get_status_display(),
+                             'rows': job.rows_count,
+                             'inserted': job.inserted_count,
+                             'updated': job.updated_count,
+                             'errors': job.errors_count,
+                             'throughput': round(job.get_throughput(), 1),
+                             'error': job.error,
+                             })
+
+
 class GroupChange(generic.DetailView):
     model = Group
     permission_name = 'auth.view_group'
@@ -874,9 +889,19 @@ class GroupChange(generic.DetailView):
 class Export(generic.SearchFormMixin, generic.LoginRequiredMixin,
              generic.LatePermissionMixin, ListView):
 
+    def get_saved_search(self):
+        if not hasattr(self, 'saved_search'):
+            self.saved_search = get_object_or_404(
+                SavedSearch.get_queryset(self.request.user),
+                slug=self.kwargs['slug'])
+        return self.saved_search
+
     def get_model(self):
-        types = {c[0].lower(): c for c in SEARCH_CHOICES}
-        class_name = types[self.kwargs['type']][0]
+        if 'type' in self.kwargs:
+            types = {c[0].lower(): c for c in SEARCH_CHOICES}
+            class_name = types[self.kwargs['type']][0]
+        else:
+            class_name = self.get_saved_search().type
         from . import models
         self.model = getattr(models, class_name)
         return self.model
@@ -887,58 +912,42 @@ class Export(generic.SearchFormMixin, generic.LoginRequiredMixin,
             form_class_name = '{}SearchForm'.format(
                 types[self.kwargs['type']][0])
         else:
-            obj = self.get_object()
             form_class_name = '{}SearchForm'.format(
-                obj._meta.model_name)
+                self.get_saved_search().type)
         from . import forms
         return getattr(forms, form_class_name)
 
+    def get_queryset(self):
+        if 'slug' in self.kwargs:
+            return self.get_saved_search()\
+                .get_search_queryset(self.request.user)
+        return super().get_queryset()
+
     def get(self, request, *args, **kwargs):
         model = self.get_model()
-        super().get(request, *args, **kwargs)
-        qs = self.object_list
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; '\
-            'filename="pyru_{}_{}.csv"'.format(self.kwargs['type'],
-                                               timezone.now()
-                                               .strftime('%Y%m%d%H%M%S'))
+        qs = self.get_queryset()
         export = model.export_data(qs)
-        if len(export):
-            writer = csv.DictWriter(response, fieldnames=export[0].keys(),
-                                    escapechar='\\', doublequote=False)
-            writer.writeheader()
-            for row in export:
-                writer.writerow(row)
+        try:
+            writer, content_type, extension = \
+                FORMATS[request.GET.get('format', 'csv')]
+        except KeyError:
+            raise Http404('Format d’export inconnu.')
+        response = StreamingHttpResponse(writer(export.header, export),
+                                         content_type=content_type)
+        name = self.kwargs.get('type') or self.kwargs['slug']
+        response['Content-Disposition'] = 'attachment; '\
+            'filename="pyru_{}_{}.{}"'.format(name,
+                                              timezone.now()
+                                              .strftime('%Y%m%d%H%M%S'),
+                                              extension)
         return response
 
 
 class ContactFastSearch(generic.ListView):
     model = Contact
 
-    def get_queryset(self):
-        qs = super().get_queryset()
-        if 'q' in self.request.GET:
-            query_words = self.request.GET['q'].split(' ')
-            filters = []
-            for word in query_words:
-                filters.append(Q(firstname__icontains=word)
-                               | Q(lastname__icontains=word)
-                               | Q(company__name__icontains=word))
-            query = reduce(operator.and_, filters)
-            qs = qs.filter(query)
-
-        qs = qs.distinct()[:10]
-        return qs
-
-    def get(self, *args, **kwargs):
-        super().get(*args, **kwargs)
-        response = HttpResponse(content_type='application/json')
-        content = []
-        for obj in self.object_list:
-            company = '' if obj.company is None else\
-                ' ({})'.format(obj.company)
-            row = {'name': '{}{}'.format(obj, company),
-                   'url': obj.get_absolute_url()}
-            content.append(row)
-        response.write(json.dumps(content))
-        return response
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(
+            typeahead.search(request.user.default_group.group_id,
+                             request.GET.get('q', '')),
+            safe=False)
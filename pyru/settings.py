@@ -120,6 +120,48 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Uploaded files (import jobs)
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Autocomplete: answer from in-process indexes of the names of each group,
+# kept within AUTOCOMPLETE_MEMORY_BUDGET bytes. The indexes match the start of
+# the names only: contacts are no longer found by the middle of their names.
+
+AUTOCOMPLETE_INDEX = False
+AUTOCOMPLETE_MEMORY_BUDGET = 64 * 1024 * 1024
+
+# Saved searches menu: cached per group in the default cache, and invalidated
+# when one of its searches is written. With a per-process cache (the default
+# one), other processes see the changes after SEARCH_MENU_CACHE_TIMEOUT
+# seconds; configure a shared cache (CACHES) for them to see them at once.
+
+SEARCH_MENU_CACHE_TIMEOUT = 30
+
+# Lists counts: exact counts are cached per query in the default cache, and
+# invalidated when one of the tables they read is written. With a per-process
+# cache, other processes see the changes after COUNT_CACHE_TIMEOUT seconds.
+
+COUNT_CACHE_TIMEOUT = 30
+
+# Search plans: the SQL query and the plan of the database for each search
+# are shown under the search form, at the cost of an EXPLAIN query.
+
+SEARCH_EXPLAIN = False
+
+# Saved searches counts: flagged as stale when their items change, and
+# counted again in the background by `manage.py refresh_searches`, which must
+# be kept running (e.g. as a service).
+
+# Import jobs: run by `manage.py import_worker`. A running job without
+# progress for IMPORT_JOB_TIMEOUT seconds is taken again by another worker.
+
+IMPORT_JOB_TIMEOUT = 600
+
+# Properties displayed on the lists: the indexes ordering the lists by them
+# are built by the import workers when the properties change (or by
+# `manage.py sync_property_indexes`).
+
 
 LOGGING = {
     'version': 1,
@@ -154,6 +196,14 @@ LOGGING = {
             'handlers': ['console'],
             'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
         },
+        'import.job': {
+            'handlers': ['console'],
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
+        },
+        'search.count': {
+            'handlers': ['console'],
+            'level': os.getenv('DJANGO_LOG_LEVEL', 'DEBUG'),
+        },
     },
 }
 